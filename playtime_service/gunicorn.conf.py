@@ -0,0 +1,63 @@
+"""
+Конфиг gunicorn, подхватывается автоматически из рабочей директории
+
+GUNICORN_PRELOAD=false отключает preload_app, тогда каждый воркер
+импортирует приложение сам
+
+Воркеры gthread обслуживают GUNICORN_THREADS запросов одновременно, ограничения
+[ADMISSION] считаются на процесс, поэтому MAX_CONCURRENT_REQUESTS должен быть
+меньше количества потоков, иначе лишние запросы ждут в очереди вместо быстрого отказа
+"""
+
+import os
+import time
+
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() == "true"
+
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "20"))
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+
+    from playtime.startup import preload_modules
+
+    server.log.info(f"Модули предзагружены в master процессе за {preload_modules():.3f} с")
+
+
+def pre_fork(server, worker):
+    if not preload_app:
+        return
+
+    from playtime.startup import close_connections_before_fork
+
+    close_connections_before_fork()
+
+
+def post_fork(server, worker):
+    worker.boot_started_at = time.perf_counter()
+    worker.first_request_started_at = None
+    worker.first_request_logged = False
+
+
+def post_worker_init(worker):
+    worker.log.info(f"Воркер {worker.pid} готов за {time.perf_counter() - worker.boot_started_at:.3f} с")
+
+
+def pre_request(worker, req):
+    if not worker.first_request_logged and worker.first_request_started_at is None:
+        worker.first_request_started_at = time.perf_counter()
+
+
+def post_request(worker, req, environ, resp):
+    if worker.first_request_logged or worker.first_request_started_at is None:
+        return
+
+    worker.first_request_logged = True
+    worker.log.info(
+        f"Воркер {worker.pid}: первый запрос {req.path} обработан за"
+        f" {time.perf_counter() - worker.first_request_started_at:.3f} с,"
+        f" {time.perf_counter() - worker.boot_started_at:.3f} с после fork"
+    )
@@ -1,7 +1,11 @@
 from django.contrib import admin
-from django.utils.html import format_html
+from django.template.response import SimpleTemplateResponse
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
 
+from .db_router import read_with_fallback, replica_reads
 from .models import BattlemetricsSetPath, Playtime, PlaytimeGetPath
+from .services import path_rate_limiter
 
 
 @admin.register(Playtime)
@@ -43,6 +47,23 @@ class PlaytimeAdmin(admin.ModelAdmin):
 
     date_hierarchy = "created_at"
 
+    def changelist_view(self, request, extra_context=None):
+        # Просмотр списка читает из реплики, действия над записями идут в основную базу
+        if request.method == "GET":
+            return read_with_fallback(lambda alias: self._render_changelist(request, extra_context, alias))
+
+        return super().changelist_view(request, extra_context)
+
+    def _render_changelist(self, request, extra_context, alias):
+        with replica_reads(alias):
+            response = super().changelist_view(request, extra_context)
+
+            # Список и фильтры вычисляются при рендере шаблона, поэтому рендерим внутри блока
+            if isinstance(response, SimpleTemplateResponse):
+                response.render()
+
+            return response
+
     @admin.display(description="Игровое время по Steam (часы)")
     def get_steam_playtime_hours(self, obj):
         return int(obj.steam_playtime / 60 / 60) if obj.steam_playtime else None
@@ -73,10 +94,32 @@ class BattlemetricsSetPathAdmin(admin.ModelAdmin):
 
 @admin.register(PlaytimeGetPath)
 class PlaytimeGetPathAdmin(admin.ModelAdmin):
-    list_display = ["change_button", "enabled", "path"]
+    list_display = ["change_button", "enabled", "path", "get_usage"]
     list_editable = ["enabled"]
     list_display_links = ["change_button", "path"]
+    readonly_fields = ["get_usage"]
 
     @admin.display(description="ID", ordering="id")
     def change_button(self, obj):
         return f"Изменить '{obj.id}'"
+
+    @admin.display(description="Использование лимитов (отклонено за сутки)")
+    def get_usage(self, obj):
+        if obj.pk is None:
+            return "-"
+
+        usage = path_rate_limiter.get_usage(obj)
+        limits = [
+            ("Запросов в секунду", "requests", obj.requests_per_second),
+            ("Steam ID в минуту", "steam_ids", obj.steam_ids_per_minute),
+            ("Steam ID с is_need_update в час", "forced_refresh_ids", obj.forced_refresh_ids_per_hour),
+        ]
+
+        return format_html_join(
+            mark_safe("<br>"),
+            "{}: {} / {} ({})",
+            (
+                (description, usage[name][0], limit if limit else "∞", usage[name][1])
+                for description, name, limit in limits
+            ),
+        )
@@ -0,0 +1,113 @@
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Literal
+
+from . import metrics
+
+RequestKind = Literal["steam", "db", "webhook"]
+
+
+class AdmissionController:
+    """Ограничивает количество одновременных запросов в процессе
+
+    Запросы которые ходят в Steam (kind="steam") могут занять не больше
+    steam_share от max_concurrent_requests, остаток всегда остается для
+    вебхуков и чтений только из базы. Отдельно ограничивается количество
+    одновременных запросов игрового времени в Steam (max_steam_lookups),
+    включая доделывающиеся в фоне после дедлайна
+    """
+
+    def __init__(
+        self, *, enabled: bool, max_concurrent_requests: int, steam_share: float, max_steam_lookups: int
+    ) -> None:
+        self.enabled = enabled
+        self.max_concurrent_requests = max_concurrent_requests
+        self.max_steam_requests = max(1, int(max_concurrent_requests * steam_share))
+        self.max_steam_lookups = max_steam_lookups
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._steam_requests = 0
+        self._steam_lookups = 0
+
+        metrics.register_gauge("admission_requests_in_flight", lambda: self._requests)
+        metrics.register_gauge("admission_steam_requests_in_flight", lambda: self._steam_requests)
+        metrics.register_gauge("admission_steam_lookups_in_flight", lambda: self._steam_lookups)
+
+    @contextmanager
+    def admit(self, kind: RequestKind) -> Iterator[bool]:
+        """Занимает место под запрос на время блока, возвращает False если места нет"""
+        admitted = self._try_acquire(kind)
+        metrics.increment("admission_decisions", kind=kind, decision="admitted" if admitted else "shed")
+
+        try:
+            yield admitted
+        finally:
+            if admitted:
+                self._release(kind)
+
+    @contextmanager
+    def reclassify_as_steam(self) -> Iterator[bool]:
+        """Переводит место уже допущенного запроса из чтений в запросы в Steam на время блока
+
+        Для запросов, которые пошли в Steam только после чтения из базы (неизвестные игроки),
+        возвращает False если место под запрос в Steam занято
+        """
+        with self._lock:
+            admitted = not self.enabled or self._steam_requests < self.max_steam_requests
+            if admitted:
+                self._steam_requests += 1
+
+        metrics.increment("admission_decisions", kind="steam_reclassified", decision="admitted" if admitted else "shed")
+
+        try:
+            yield admitted
+        finally:
+            if admitted:
+                with self._lock:
+                    self._steam_requests -= 1
+
+    def can_start_steam_lookups(self, count: int) -> bool:
+        if not self.enabled:
+            return True
+
+        with self._lock:
+            # Один большой запрос пропускается если сейчас в Steam ничего не запрашивается
+            admitted = self._steam_lookups == 0 or self._steam_lookups + count <= self.max_steam_lookups
+
+        if not admitted:
+            metrics.increment("admission_decisions", kind="steam_lookups", decision="shed")
+
+        return admitted
+
+    @contextmanager
+    def track_steam_lookups(self, count: int) -> Iterator[None]:
+        with self._lock:
+            self._steam_lookups += count
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._steam_lookups -= count
+
+    def _try_acquire(self, kind: RequestKind) -> bool:
+        with self._lock:
+            if self.enabled:
+                if self._requests >= self.max_concurrent_requests:
+                    return False
+
+                if kind == "steam" and self._steam_requests >= self.max_steam_requests:
+                    return False
+
+            self._requests += 1
+            if kind == "steam":
+                self._steam_requests += 1
+
+            return True
+
+    def _release(self, kind: RequestKind) -> None:
+        with self._lock:
+            self._requests -= 1
+            if kind == "steam":
+                self._steam_requests -= 1
@@ -0,0 +1,61 @@
+"""
+Фоновые event loop и пул потоков процесса
+
+Создаются лениво при первом обращении и пересоздаются после fork, поэтому
+безопасны при preload в gunicorn
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+from django.db import close_old_connections
+
+_lock = threading.Lock()
+_pid: int | None = None
+_loop: asyncio.AbstractEventLoop | None = None
+_executor: ThreadPoolExecutor | None = None
+
+
+def _ensure_started() -> None:
+    global _pid, _loop, _executor
+
+    with _lock:
+        if _pid == os.getpid():
+            return
+
+        _loop = asyncio.new_event_loop()
+        threading.Thread(target=_loop.run_forever, name="playtime-background-loop", daemon=True).start()
+
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="playtime-background-db")
+        _pid = os.getpid()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Event loop в отдельном потоке, задачи в нём переживают запрос, который их создал"""
+    _ensure_started()
+    return _loop  # type: ignore
+
+
+def run_coroutine(coroutine) -> Future:
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop())
+
+
+def _call_with_db(fn: Callable, *args, **kwargs):
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    except Exception as e:
+        logging.error(f"Ошибка в фоновой задаче {fn.__name__}: {e}", exc_info=e)
+        raise
+    finally:
+        close_old_connections()
+
+
+def submit_db_task(fn: Callable, *args, **kwargs) -> Future:
+    """Выполняет fn в фоновом потоке для работы с базой"""
+    _ensure_started()
+    return _executor.submit(_call_with_db, fn, *args, **kwargs)  # type: ignore
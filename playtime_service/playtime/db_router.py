@@ -0,0 +1,216 @@
+"""
+Чтение из реплик PostgreSQL
+
+Из реплик читаются только явно отмеченные чтения через read_with_fallback.
+Всё остальное, чтения внутри transaction.atomic() и все чтения запроса после
+первой записи в нём идут в основную базу. Реплика с отставанием больше
+DATABASE_REPLICA_MAX_LAG или недоступная временно не используется, чтение,
+на котором реплика перестала отвечать, повторяется в основной базе
+"""
+
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator, TypeVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+
+from . import metrics
+
+T = TypeVar("T")
+
+_replica_reads: ContextVar[str | None] = ContextVar("replica_reads", default=None)
+_primary_pinned: ContextVar[bool] = ContextVar("primary_pinned", default=False)
+
+# Отставание реплики в секундах, на основной базе (не в recovery) - 0
+_REPLICA_LAG_SQL = (
+    "SELECT CASE"
+    " WHEN NOT pg_is_in_recovery() THEN 0"
+    " WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+    " ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)"
+    " END"
+)
+
+
+class ReplicaLagMonitor:
+    """Выбирает реплику для чтения по кругу среди тех, чьё отставание в пределах max_lag
+
+    Отставание каждой реплики проверяется не чаще раза в check_interval секунд
+    в потоке, который первым за ней обратился, остальные используют прошлый результат
+    """
+
+    def __init__(self, *, aliases: list[str], max_lag: float, check_interval: float) -> None:
+        self.aliases = aliases
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._round_robin = itertools.cycle(aliases) if aliases else None
+        self._lags: dict[str, float | None] = {}
+        self._checked_at: dict[str, float] = {}
+
+        for alias in aliases:
+            metrics.register_gauge("replica_lag_seconds", lambda alias=alias: self._lags.get(alias) or 0, alias=alias)
+
+    def get_replica(self) -> str | None:
+        """Реплика для чтения или None, если подходящих реплик нет"""
+        if self._round_robin is None:
+            return None
+
+        for _ in range(len(self.aliases)):
+            with self._lock:
+                alias = next(self._round_robin)
+
+            if self._is_healthy(alias):
+                return alias
+
+        metrics.increment("replica_reads_fallback")
+        return None
+
+    def _is_healthy(self, alias: str) -> bool:
+        now = time.monotonic()
+
+        with self._lock:
+            is_check_needed = now - self._checked_at.get(alias, -self.check_interval) >= self.check_interval
+            if is_check_needed:
+                self._checked_at[alias] = now
+
+        if is_check_needed:
+            self._lags[alias] = self._check_lag(alias)
+
+        lag = self._lags.get(alias)
+        return lag is not None and lag <= self.max_lag
+
+    def mark_unavailable(self, alias: str, error: Exception) -> None:
+        """Не использовать реплику до следующей проверки отставания"""
+        logging.warning(f"Реплика {alias} не ответила на чтение, чтение идёт из основной базы: {error}")
+        metrics.increment("replica_read_errors", alias=alias)
+
+        with self._lock:
+            self._lags[alias] = None
+            self._checked_at[alias] = time.monotonic()
+
+    def _check_lag(self, alias: str) -> float | None:
+        connection = connections[alias]
+
+        # Например реплика-псевдоним на sqlite в локальной проверке
+        if connection.vendor != "postgresql":
+            return 0
+
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(_REPLICA_LAG_SQL)
+                lag = float(cursor.fetchone()[0])
+        except Exception as e:
+            logging.warning(f"Реплика {alias} недоступна, чтение идёт из основной базы: {e}")
+            return None
+
+        if lag > self.max_lag:
+            logging.warning(f"Реплика {alias} отстаёт на {lag:.1f} с, чтение идёт из основной базы")
+
+        return lag
+
+
+replica_lag_monitor = ReplicaLagMonitor(
+    aliases=settings.DATABASE_REPLICAS,
+    max_lag=settings.DATABASE_REPLICA_MAX_LAG,
+    check_interval=settings.DATABASE_REPLICA_LAG_CHECK_INTERVAL,
+)
+
+
+def get_read_database() -> str:
+    """База для чтения, которое допускает отставание реплики"""
+    if _primary_pinned.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return DEFAULT_DB_ALIAS
+
+    alias = replica_lag_monitor.get_replica() or DEFAULT_DB_ALIAS
+    metrics.increment("database_reads", alias=alias)
+
+    return alias
+
+
+def read_with_fallback(read: Callable[[str], T]) -> T:
+    """Выполняет read в базе для чтения, если реплика не отвечает - повторяет его в основной базе
+
+    Args:
+        read: Принимает псевдоним базы и сразу выполняет запросы, а не возвращает ленивый QuerySet
+    """
+    alias = get_read_database()
+    if alias == DEFAULT_DB_ALIAS:
+        return read(alias)
+
+    try:
+        return read(alias)
+    except OperationalError as e:
+        replica_lag_monitor.mark_unavailable(alias, e)
+
+    return read(DEFAULT_DB_ALIAS)
+
+
+def pin_to_primary() -> None:
+    """Все дальнейшие чтения текущего запроса идут в основную базу, чтобы видеть свои записи"""
+    _primary_pinned.set(True)
+
+
+@contextmanager
+def replica_reads(alias: str) -> Iterator[None]:
+    """Чтения ORM внутри блока идут в базу alias, пока запрос ничего не записал"""
+    token = _replica_reads.set(alias)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = _replica_reads.get()
+        if alias is None or _primary_pinned.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+
+        return alias
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaRoutingMiddleware:
+    """Сбрасывает привязку к основной базе в начале каждого запроса"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response) -> None:
+        self.get_response = get_response
+
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        token = _primary_pinned.set(False)
+        try:
+            return self.get_response(request)
+        finally:
+            _primary_pinned.reset(token)
+
+    async def __acall__(self, request):
+        token = _primary_pinned.set(False)
+        try:
+            return await self.get_response(request)
+        finally:
+            _primary_pinned.reset(token)
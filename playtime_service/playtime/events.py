@@ -0,0 +1,167 @@
+"""
+События изменения игрового времени через PostgreSQL LISTEN/NOTIFY
+
+Запись публикуется через pg_notify в той же транзакции, поэтому подписчики
+получают событие только после коммита. Каждый ASGI процесс держит одно
+соединение с LISTEN и раздаёт события своим подписчикам
+"""
+
+import asyncio
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Iterable
+
+from django.conf import settings
+from django.db import connection
+
+from . import metrics
+
+PLAYTIME_CHANGES_CHANNEL = "playtime_changes"
+
+# Лимит полезной нагрузки NOTIFY - 8000 байт, steam_id с кавычками и запятой занимает ~20
+_NOTIFY_STEAM_IDS_CHUNK = 300
+
+_RECONNECT_DELAY = 5
+
+
+def publish_playtime_changes(*, game_id: int, steam_ids: Iterable[str] | None) -> None:
+    """Публикует изменение игрового времени
+
+    Args:
+        steam_ids: Изменившиеся игроки, None если изменилось много игроков и подписчикам
+                   нужно перечитать игру целиком
+    """
+    if not settings.PLAYTIME_EVENTS_ENABLE or connection.vendor != "postgresql":
+        return
+
+    if steam_ids is None:
+        payloads = [json.dumps({"game_id": game_id, "steam_ids": None})]
+    else:
+        steam_ids = list(steam_ids)
+        payloads = [
+            json.dumps({"game_id": game_id, "steam_ids": steam_ids[i : i + _NOTIFY_STEAM_IDS_CHUNK]})
+            for i in range(0, len(steam_ids), _NOTIFY_STEAM_IDS_CHUNK)
+        ]
+
+    with connection.cursor() as cursor:
+        for payload in payloads:
+            cursor.execute("SELECT pg_notify(%s, %s)", [PLAYTIME_CHANGES_CHANNEL, payload])
+
+
+@dataclass(eq=False)
+class PlaytimeSubscription:
+    """Подписка сервера на изменения игры, steam_ids None - на всех игроков игры"""
+
+    game_id: int
+    steam_ids: frozenset[str] | None
+    queue: asyncio.Queue = field(repr=False)
+    # Часть событий потеряна (переполнение очереди, переподключение к базе) - нужно перечитать игру
+    need_resync: bool = False
+
+    def matches(self, game_id: int, steam_ids: list[str] | None) -> list[str] | None:
+        """Отбирает из события игроков подписки
+
+        Returns:
+            list[str] | None: Игроки подписки из события, пустой список если событие не относится к подписке,
+                              None если событие требует перечитать игру целиком
+        """
+        if game_id != self.game_id:
+            return []
+
+        if steam_ids is None:
+            return None
+
+        if self.steam_ids is None:
+            return steam_ids
+
+        return [steam_id for steam_id in steam_ids if steam_id in self.steam_ids]
+
+    def put(self, steam_ids: list[str] | None) -> None:
+        try:
+            self.queue.put_nowait(steam_ids)
+        except asyncio.QueueFull:
+            self.need_resync = True
+            metrics.increment("playtime_events_dropped")
+
+
+class PlaytimeChangesHub:
+    """Одно соединение с LISTEN на процесс, раздаёт события подписчикам в их очереди
+
+    Соединение открывается с первым подписчиком и закрывается после ухода последнего
+    """
+
+    def __init__(self, *, queue_size: int) -> None:
+        self.queue_size = queue_size
+        self.subscriptions: set[PlaytimeSubscription] = set()
+        self._task: asyncio.Task | None = None
+
+    def subscribe(self, *, game_id: int, steam_ids: Iterable[str] | None) -> PlaytimeSubscription:
+        subscription = PlaytimeSubscription(
+            game_id=game_id,
+            steam_ids=frozenset(steam_ids) if steam_ids is not None else None,
+            queue=asyncio.Queue(maxsize=self.queue_size),
+        )
+        self.subscriptions.add(subscription)
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._listen())
+
+        return subscription
+
+    def unsubscribe(self, subscription: PlaytimeSubscription) -> None:
+        self.subscriptions.discard(subscription)
+
+        if not self.subscriptions and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def dispatch(self, payload: str) -> None:
+        try:
+            event = json.loads(payload)
+            game_id, steam_ids = int(event["game_id"]), event["steam_ids"]
+        except (ValueError, KeyError, TypeError):
+            logging.warning(f"Некорректное событие изменения игрового времени: {payload}")
+            return
+
+        metrics.increment("playtime_events_received")
+
+        for subscription in self.subscriptions:
+            matched = subscription.matches(game_id, steam_ids)
+            if matched is None or matched:
+                subscription.put(matched)
+
+    async def _listen(self) -> None:
+        import psycopg
+
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(**_get_listen_connection_kwargs()) as conn:
+                    await conn.execute(f"LISTEN {PLAYTIME_CHANGES_CHANNEL}")
+
+                    async for notify in conn.notifies():
+                        self.dispatch(notify.payload)
+            except psycopg.Error as e:
+                logging.warning(f"Потеряно соединение LISTEN {PLAYTIME_CHANGES_CHANNEL}: {e}")
+
+            # Пока соединения не было события могли пропасть
+            for subscription in self.subscriptions:
+                subscription.put(None)
+
+            await asyncio.sleep(_RECONNECT_DELAY)
+
+
+def _get_listen_connection_kwargs() -> dict:
+    database = settings.DATABASES["default"]
+    kwargs = {
+        "dbname": database["NAME"],
+        "user": database.get("USER"),
+        "password": database.get("PASSWORD"),
+        "host": database.get("HOST"),
+        "port": database.get("PORT"),
+        "autocommit": True,
+    }
+    return {key: value for key, value in kwargs.items() if value not in (None, "")}
+
+
+playtime_changes_hub = PlaytimeChangesHub(queue_size=settings.PLAYTIME_EVENTS_QUEUE_SIZE)
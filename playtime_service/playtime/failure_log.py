@@ -0,0 +1,99 @@
+"""
+Сводные записи об ошибках запросов в Steam
+
+Вместо записи в лог каждой ошибки на запрос сервиса пишется одна сводка,
+сгруппированная по методу Steam API и классу ошибки. Одинаковые группы
+попадают в лог не чаще раза в interval секунд на процесс, пропущенные
+сводки суммируются в следующую. Точные количества всегда уходят в метрики
+"""
+
+import logging
+import threading
+import time
+from collections import Counter
+from typing import TYPE_CHECKING
+
+from . import metrics
+
+if TYPE_CHECKING:
+    from steam_playtime import SteamFailures
+
+FailureKey = tuple[str, str]
+
+
+class SteamFailureLog:
+    """
+    Args:
+        interval: Не чаще скольких секунд писать в лог одну и ту же группу ошибок
+        traceback_interval: Не чаще скольких секунд прикладывать к сводке стек вызовов одной группы
+    """
+
+    def __init__(self, *, interval: float, traceback_interval: float) -> None:
+        self.interval = interval
+        self.traceback_interval = traceback_interval
+
+        self._lock = threading.Lock()
+        self._logged_at: dict[FailureKey, float] = {}
+        self._traceback_logged_at: dict[FailureKey, float] = {}
+        self._suppressed: Counter[FailureKey] = Counter()
+
+    def report(self, failures: "SteamFailures", **context: str | int) -> None:
+        """Считает ошибки в метриках и пишет сводку, если для её групп не превышен лимит записей
+
+        Args:
+            context: Данные запроса сервиса для сводки (game_id, количество игроков и т.д.)
+        """
+        if not failures:
+            return
+
+        for (endpoint, error), count in failures.counts.items():
+            metrics.increment("steam_failures", count, endpoint=endpoint, error=error)
+
+        now = time.monotonic()
+        groups = []
+        traceback = None
+
+        with self._lock:
+            for key, count in failures.counts.items():
+                if now - self._logged_at.get(key, -self.interval) < self.interval:
+                    self._suppressed[key] += count
+                    continue
+
+                self._logged_at[key] = now
+                endpoint, error = key
+                groups.append(
+                    {
+                        "endpoint": endpoint,
+                        "error": error,
+                        "count": count,
+                        "suppressed": self._suppressed.pop(key, 0),
+                        "steam_ids": failures.examples.get(key, []),
+                    }
+                )
+
+                # Один стек вызовов на сводку, и для одной группы не чаще раза в traceback_interval
+                sample = failures.samples.get(key)
+                if (
+                    traceback is None
+                    and sample is not None
+                    and now - self._traceback_logged_at.get(key, -self.traceback_interval) >= self.traceback_interval
+                ):
+                    self._traceback_logged_at[key] = now
+                    traceback = sample
+
+        if not groups:
+            metrics.increment("steam_failure_logs_suppressed")
+            return
+
+        groups_text = ", ".join(
+            f"{group['endpoint']} {group['error']} x{group['count']}"
+            + (f" (+{group['suppressed']} ранее)" if group["suppressed"] else "")
+            for group in groups
+        )
+        context_text = ", ".join(f"{key}={value}" for key, value in context.items())
+
+        logging.error(
+            f"Ошибки запросов в Steam ({context_text}): {groups_text}",
+            exc_info=traceback,
+            extra={"steam_failures": groups, **context},
+        )
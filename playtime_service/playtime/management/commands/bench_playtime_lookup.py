@@ -0,0 +1,92 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+# Первый Steam ID 64
+_STEAM_ID_BASE = 76561197960265728
+
+_COLUMNS = (
+    "steam_id varchar(18) NOT NULL, game_id integer NOT NULL, steam_playtime integer, bm_playtime integer,"
+    " updated_at timestamp with time zone NOT NULL"
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнение задержки выборки игрового времени (как в get-playtime) из обычной таблицы с уникальным индексом"
+        " (steam_id, game_id), обычной с индексом (game_id, steam_id) и секционированной по game_id"
+        " на одинаковых синтетических данных во временных таблицах"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--players", type=int, default=200_000, help="Игроков в каждой игре")
+        parser.add_argument("--games", type=int, default=5, help="Количество игр")
+        parser.add_argument("--batch", type=int, default=100, help="Steam ID в одном запросе")
+        parser.add_argument("--queries", type=int, default=500, help="Количество запросов на каждую таблицу")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Секционирование поддерживается только для PostgreSQL")
+
+        players, games = options["players"], options["games"]
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            self.stdout.write(f"Заполнение {players * games} строк...")
+            self._create_tables(cursor, players=players, games=games)
+
+            lookups = [
+                (
+                    random.randint(1, games),
+                    [str(_STEAM_ID_BASE + random.randrange(players)) for _ in range(options["batch"])],
+                )
+                for _ in range(options["queries"])
+            ]
+
+            self.stdout.write(f"{'Таблица':<20}{'p50, мс':>10}{'p95, мс':>10}{'среднее, мс':>14}")
+            for table in ("bench_plain", "bench_game_index", "bench_partitioned"):
+                timings = self._measure(cursor, table=table, lookups=lookups)
+                p95 = statistics.quantiles(timings, n=20)[-1]
+                self.stdout.write(
+                    f"{table:<20}{statistics.median(timings):>10.3f}{p95:>10.3f}{statistics.mean(timings):>14.3f}"
+                )
+
+            transaction.set_rollback(True)
+
+    def _create_tables(self, cursor, *, players: int, games: int) -> None:
+        cursor.execute(f"CREATE TEMPORARY TABLE bench_plain ({_COLUMNS}, UNIQUE (steam_id, game_id))")
+        # Обычная таблица с индексом, где game_id идёт первым, как у выборки get-playtime
+        cursor.execute(f"CREATE TEMPORARY TABLE bench_game_index ({_COLUMNS})")
+        cursor.execute("CREATE INDEX ON bench_game_index (game_id, steam_id)")
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE bench_partitioned ({_COLUMNS}, UNIQUE (steam_id, game_id))"
+            " PARTITION BY LIST (game_id)"
+        )
+        for game_id in range(1, games + 1):
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE bench_partitioned_{game_id}"
+                f" PARTITION OF bench_partitioned FOR VALUES IN ({game_id})"
+            )
+
+        cursor.execute(
+            "INSERT INTO bench_plain"
+            f" SELECT ({_STEAM_ID_BASE} + player)::text, game_id, player % 100000, NULL, NOW()"
+            f" FROM generate_series(0, {players - 1}) player, generate_series(1, {games}) game_id"
+        )
+        cursor.execute("INSERT INTO bench_game_index SELECT * FROM bench_plain")
+        cursor.execute("INSERT INTO bench_partitioned SELECT * FROM bench_plain")
+        cursor.execute("ANALYZE bench_plain")
+        cursor.execute("ANALYZE bench_game_index")
+        cursor.execute("ANALYZE bench_partitioned")
+
+    def _measure(self, cursor, *, table: str, lookups: list[tuple[int, list[str]]]) -> list[float]:
+        timings = []
+        for game_id, steam_ids in lookups:
+            started_at = time.perf_counter()
+            cursor.execute(f"SELECT * FROM {table} WHERE game_id = %s AND steam_id = ANY(%s)", [game_id, steam_ids])
+            cursor.fetchall()
+            timings.append((time.perf_counter() - started_at) * 1000)
+
+        return timings
@@ -0,0 +1,64 @@
+import json
+import random
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+
+import msgpack
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from playtime.models import Playtime
+from playtime.renderers import MessagePackRenderer
+from playtime.views import PlaytimeGetApi
+
+
+class Command(BaseCommand):
+    help = "Сравнение размера ответа get-playtime и времени кодирования/декодирования в JSON и MessagePack"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100, help="Количество игроков в ответе")
+        parser.add_argument("--iterations", type=int, default=1000, help="Количество повторов каждого замера")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        playtimes = [
+            Playtime(
+                steam_id=str(76561197960265728 + random.randrange(10**9)),
+                game_id=393380,
+                steam_playtime=random.randrange(10**7),
+                bm_playtime=random.choice([None, random.randrange(10**7)]),
+                created_at=now - timedelta(days=random.randrange(1000)),
+                updated_at=now - timedelta(seconds=random.randrange(10**6)),
+            )
+            for _ in range(options["rows"])
+        ]
+
+        view = PlaytimeGetApi()
+        formats = {
+            "json": (JSONRenderer(), "application/json", json.loads),
+            "msgpack": (MessagePackRenderer(), "application/msgpack", msgpack.unpackb),
+            "msgpack columnar": (MessagePackRenderer(), "application/msgpack; layout=columnar", msgpack.unpackb),
+        }
+
+        self.stdout.write(f"{'Формат':<20}{'Размер, байт':>14}{'Кодирование, мкс':>20}{'Декодирование, мкс':>22}")
+
+        for name, (renderer, media_type, decode) in formats.items():
+            request = SimpleNamespace(accepted_renderer=renderer, accepted_media_type=media_type)
+
+            def encode():
+                return renderer.render(view._serialize_playtimes(request, playtimes), accepted_media_type=media_type)
+
+            body = encode()
+            encode_time = self._measure(encode, options["iterations"])
+            decode_time = self._measure(lambda: decode(body), options["iterations"])
+
+            self.stdout.write(f"{name:<20}{len(body):>14}{encode_time * 10**6:>20.1f}{decode_time * 10**6:>22.1f}")
+
+    def _measure(self, fn, iterations: int) -> float:
+        started_at = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+
+        return (time.perf_counter() - started_at) / iterations
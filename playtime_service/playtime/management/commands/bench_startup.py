@@ -0,0 +1,113 @@
+import json
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Выполняется в отдельном процессе, чтобы мерить холодный старт
+_STARTUP_SCRIPT = """
+import json
+import time
+
+started_at = time.perf_counter()
+
+from django.core.wsgi import get_wsgi_application
+
+application = get_wsgi_application()
+app_loaded_at = time.perf_counter()
+
+preload = {preload}
+if preload:
+    from playtime.startup import preload_modules
+
+    preload_modules()
+preloaded_at = time.perf_counter()
+
+import hmac
+
+from django.db import transaction
+from django.test import Client
+from django.test.utils import setup_test_environment
+
+from playtime.models import Playtime, PlaytimeGetPath
+
+# Разрешает хост testserver тестового клиента
+setup_test_environment()
+client = Client()
+body = json.dumps({{"steam_ids": ["76561198000000001"], "game_id": 1, "is_need_update": False}})
+
+# Путь и игрок создаются в откатываемой транзакции, поэтому запрос отвечает из базы, не ходит в Steam
+# и ничего не оставляет после замера
+with transaction.atomic():
+    PlaytimeGetPath.objects.update_or_create(
+        path="bench-startup", defaults={{"enabled": True, "hmac_secret_key": "bench", "fixed_game_id": None}}
+    )
+    Playtime.objects.get_or_create(steam_id="76561198000000001", game_id=1, defaults={{"steam_playtime": 60}})
+
+    request_started_at = time.perf_counter()
+    response = client.post(
+        "/get-playtime/bench-startup/",
+        body,
+        content_type="application/json",
+        headers={{"X-Signature": hmac.digest(b"bench", body.encode(), "sha256").hex()}},
+    )
+    first_request_at = time.perf_counter()
+
+    transaction.set_rollback(True)
+
+if response.status_code != 200:
+    raise SystemExit(f"get-playtime ответил {{response.status_code}}: {{response.content[:200]}}")
+
+import steam_playtime
+
+steam_imported_at = time.perf_counter()
+
+print(json.dumps({{
+    "app_import": app_loaded_at - started_at,
+    "preload": preloaded_at - app_loaded_at,
+    "first_request": first_request_at - request_started_at,
+    "steam_first_use": steam_imported_at - first_request_at,
+}}))
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Замер холодного старта воркера: импорт приложения, предзагрузка модулей, первый запрос и"
+        " первое обращение к клиенту Steam, с preload и без"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=5, help="Количество запусков для каждого режима")
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'Режим':<12}{'Импорт, мс':>12}{'Preload, мс':>14}{'1й запрос, мс':>16}{'1е обращение к Steam, мс':>27}"
+        )
+
+        for preload in (False, True):
+            runs = [self._run(preload) for _ in range(options["runs"])]
+            medians = {key: statistics.median(run[key] for run in runs) * 1000 for key in runs[0]}
+
+            self.stdout.write(
+                f"{'preload' if preload else 'lazy':<12}{medians['app_import']:>12.1f}{medians['preload']:>14.1f}"
+                f"{medians['first_request']:>16.1f}{medians['steam_first_use']:>27.1f}"
+            )
+
+        self.stdout.write(
+            "С preload импорт и предзагрузка выполняются один раз в master процессе gunicorn, а не в каждом воркере"
+        )
+
+    def _run(self, preload: bool) -> dict[str, float]:
+        result = subprocess.run(
+            [sys.executable, "-c", _STARTUP_SCRIPT.format(preload=preload)],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            raise CommandError(f"Замер завершился с ошибкой:\n{result.stderr.strip()}")
+
+        return json.loads(result.stdout.strip().splitlines()[-1])
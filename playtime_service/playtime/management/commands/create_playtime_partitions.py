@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from playtime.partitioning import (
+    create_game_partition,
+    get_partitioned_game_ids,
+    get_unpartitioned_game_ids,
+    is_playtime_partitioned,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Создает секции таблицы игрового времени для game_id, которые пока лежат в секции по умолчанию. "
+        "Можно запускать периодически, чтобы новые игры получали свою секцию"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--game-id", type=int, action="append", help="Создать секцию для указанного game_id")
+        parser.add_argument("--dry-run", action="store_true", help="Только показать какие секции будут созданы")
+
+    def handle(self, *args, **options):
+        if not is_playtime_partitioned():
+            raise CommandError("Таблица игрового времени не секционирована, сначала выполните partition_playtime_table")
+
+        game_ids = set(options["game_id"] or get_unpartitioned_game_ids()) - get_partitioned_game_ids()
+
+        if not game_ids:
+            self.stdout.write("Новых game_id нет")
+            return
+
+        for game_id in sorted(game_ids):
+            if options["dry_run"]:
+                self.stdout.write(f"Будет создана секция для game_id {game_id}")
+                continue
+
+            create_game_partition(game_id)
+            self.stdout.write(self.style.SUCCESS(f"Создана секция для game_id {game_id}"))
@@ -0,0 +1,160 @@
+import csv
+import json
+import re
+import time
+from pathlib import Path
+from typing import Iterator
+
+from django.core.management.base import BaseCommand, CommandError
+
+from playtime.services import import_playtimes
+
+_STEAM_ID_REGEX = re.compile(r"^76\d{15,16}$")
+# game_id и игровое время хранятся в integer колонках
+_INT_MIN, _INT_MAX = -(2**31), 2**31 - 1
+
+
+class Command(BaseCommand):
+    help = (
+        "Массовый импорт игрового времени из CSV или NDJSON через COPY. "
+        "Ожидаемые поля: steam_id, game_id, steam_playtime, bm_playtime (время в секундах), "
+        "поле playtime записывается в колонку из --playtime-source"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", type=Path, help="Путь к файлу импорта")
+        parser.add_argument(
+            "--format", choices=["csv", "ndjson"], default=None, help="Формат файла, по умолчанию по расширению"
+        )
+        parser.add_argument("--game-id", type=int, default=None, help="Game ID для всех строк файла")
+        parser.add_argument(
+            "--playtime-source",
+            choices=["bm", "steam"],
+            default="bm",
+            help="В какую колонку записывать поле playtime",
+        )
+        parser.add_argument(
+            "--steam-conflict",
+            choices=["max", "incoming", "existing"],
+            default="max",
+            help="Правило для steam_playtime при совпадении steam_id и game_id",
+        )
+        parser.add_argument(
+            "--bm-conflict",
+            choices=["max", "incoming", "existing"],
+            default="max",
+            help="Правило для bm_playtime при совпадении steam_id и game_id",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Выполнить импорт и откатить изменения")
+        parser.add_argument("--progress-every", type=int, default=50_000, help="Выводить прогресс каждые N строк")
+
+    def handle(self, *args, **options):
+        file_path: Path = options["file"]
+        if not file_path.is_file():
+            raise CommandError(f"Файл {file_path} не найден")
+
+        if options["game_id"] is not None and not _INT_MIN <= options["game_id"] <= _INT_MAX:
+            raise CommandError(f"--game-id {options['game_id']} вне диапазона integer")
+
+        file_format = options["format"] or ("ndjson" if file_path.suffix in (".ndjson", ".jsonl") else "csv")
+
+        self.skipped = 0
+        self.started_at = time.monotonic()
+
+        # utf-8-sig убирает BOM, который Excel добавляет в начало CSV, иначе первое поле не найдётся
+        with file_path.open(newline="", encoding="utf-8-sig") as file:
+            records = self._read_csv(file) if file_format == "csv" else self._read_ndjson(file)
+            rows = self._clean_rows(
+                records, game_id=options["game_id"], playtime_column=f"{options['playtime_source']}_playtime"
+            )
+
+            result = import_playtimes(
+                rows=rows,
+                steam_conflict=options["steam_conflict"],
+                bm_conflict=options["bm_conflict"],
+                dry_run=options["dry_run"],
+                progress_every=options["progress_every"],
+                on_progress=self._report_progress,
+            )
+
+        elapsed = time.monotonic() - self.started_at
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{'[dry-run] ' if options['dry_run'] else ''}"
+                f"Скопировано: {result['copied']}, создано: {result['created']}, обновлено: {result['updated']},"
+                f" пропущено: {self.skipped}, за {elapsed:.1f} с"
+                f" ({result['copied'] / elapsed if elapsed else 0:.0f} строк/с)"
+            )
+        )
+
+    def _report_progress(self, copied: int) -> None:
+        elapsed = time.monotonic() - self.started_at
+        self.stdout.write(f"Скопировано {copied} строк, {copied / elapsed if elapsed else 0:.0f} строк/с")
+
+    def _read_csv(self, file) -> Iterator[tuple[int, dict]]:
+        for line_number, record in enumerate(csv.DictReader(file), start=2):
+            yield line_number, record
+
+    def _read_ndjson(self, file) -> Iterator[tuple[int, dict]]:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                self._skip(line_number, f"невалидный JSON: {e}")
+                continue
+
+            if not isinstance(record, dict):
+                self._skip(line_number, "ожидается JSON объект")
+                continue
+
+            yield line_number, record
+
+    def _clean_rows(
+        self, records: Iterator[tuple[int, dict]], *, game_id: int | None, playtime_column: str
+    ) -> Iterator[tuple[str, int, int | None, int | None]]:
+        for line_number, record in records:
+            steam_id = str(record.get("steam_id") or "").strip()
+            if not _STEAM_ID_REGEX.match(steam_id):
+                self._skip(line_number, f"невалидный steam_id '{steam_id}'")
+                continue
+
+            if "playtime" in record and record.get(playtime_column) in (None, ""):
+                record[playtime_column] = record["playtime"]
+
+            try:
+                row_game_id = game_id if game_id is not None else self._to_int(record.get("game_id"))
+                steam_playtime = self._to_int(record.get("steam_playtime"))
+                bm_playtime = self._to_int(record.get("bm_playtime"))
+            except ValueError as e:
+                self._skip(line_number, str(e))
+                continue
+
+            if row_game_id is None:
+                self._skip(line_number, "не указан game_id")
+                continue
+
+            yield steam_id, row_game_id, steam_playtime, bm_playtime
+
+    def _to_int(self, value) -> int | None:
+        if value is None or value == "":
+            return None
+
+        try:
+            number = int(float(value))
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError(f"невалидное число '{value}'")
+
+        if not _INT_MIN <= number <= _INT_MAX:
+            raise ValueError(f"число '{value}' вне диапазона integer")
+
+        return number
+
+    def _skip(self, line_number: int, reason: str) -> None:
+        self.skipped += 1
+        if self.skipped <= 20:
+            self.stderr.write(f"Строка {line_number} пропущена: {reason}")
+        elif self.skipped == 21:
+            self.stderr.write("Слишком много пропущенных строк, дальнейшие не выводятся")
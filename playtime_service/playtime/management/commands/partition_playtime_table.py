@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from playtime.partitioning import (
+    is_playtime_partitioned,
+    partition_playtime_table,
+    unpartition_playtime_table,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Переводит таблицу игрового времени в секционированную по game_id (только PostgreSQL). "
+        "Таблица блокируется на время переноса всех строк"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--revert", action="store_true", help="Вернуть обычную таблицу")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Секционирование поддерживается только для PostgreSQL")
+
+        if options["revert"]:
+            if not is_playtime_partitioned():
+                raise CommandError("Таблица игрового времени не секционирована")
+
+            unpartition_playtime_table()
+            self.stdout.write(self.style.SUCCESS("Таблица игрового времени снова обычная"))
+            return
+
+        if is_playtime_partitioned():
+            raise CommandError("Таблица игрового времени уже секционирована")
+
+        partition_playtime_table()
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Таблица игрового времени секционирована, секции для игр создаёт команда create_playtime_partitions"
+            )
+        )
@@ -0,0 +1,40 @@
+"""
+Простые метрики процесса, без внешних зависимостей
+
+Значения хранятся в памяти воркера, каждый воркер gunicorn отдает только свои
+"""
+
+import threading
+from collections import defaultdict
+from typing import Callable
+
+_lock = threading.Lock()
+_counters: dict[str, int] = defaultdict(int)
+_gauges: dict[str, Callable[[], float | int | str]] = {}
+
+
+def _metric_name(name: str, labels: dict[str, str | int]) -> str:
+    if not labels:
+        return name
+
+    labels_text = ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+    return f"{name}{{{labels_text}}}"
+
+
+def increment(name: str, value: int = 1, **labels: str | int) -> None:
+    with _lock:
+        _counters[_metric_name(name, labels)] += value
+
+
+def register_gauge(name: str, getter: Callable[[], float | int | str], **labels: str | int) -> None:
+    """Регистрирует значение, которое вычисляется в момент снятия метрик"""
+    with _lock:
+        _gauges[_metric_name(name, labels)] = getter
+
+
+def snapshot() -> dict[str, float | int | str]:
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+
+    return counters | {name: getter() for name, getter in gauges.items()}
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-19 12:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("playtime", "0003_alter_battlemetricssetpath_options_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="playtimegetpath",
+            name="default_deadline",
+            field=models.FloatField(
+                blank=True,
+                help_text="Не успевшие за это время запросы в Steam отдаются из базы и сохраняются в фоне",
+                null=True,
+                verbose_name="Дедлайн ожидания Steam по умолчанию (секунды)",
+            ),
+        ),
+    ]
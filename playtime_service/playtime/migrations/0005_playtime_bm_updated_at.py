@@ -0,0 +1,22 @@
+# Generated by Django 5.1.6 on 2026-10-19 12:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("playtime", "0004_playtimegetpath_default_deadline"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="playtime",
+            name="bm_updated_at",
+            field=models.DateTimeField(
+                blank=True,
+                null=True,
+                verbose_name="Время подписи последнего вебхука Battlemetrics",
+            ),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.6 on 2026-10-19 12:30
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("playtime", "0005_playtime_bm_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="playtimegetpath",
+            name="forced_refresh_ids_per_hour",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="Пусто - без ограничения, ограничивает принудительные обновления из Steam",
+                null=True,
+                verbose_name="Steam ID с is_need_update в час",
+            ),
+        ),
+        migrations.AddField(
+            model_name="playtimegetpath",
+            name="requests_per_second",
+            field=models.FloatField(
+                blank=True,
+                help_text="Пусто - без ограничения",
+                null=True,
+                validators=[django.core.validators.MinValueValidator(0.01)],
+                verbose_name="Запросов в секунду",
+            ),
+        ),
+        migrations.AddField(
+            model_name="playtimegetpath",
+            name="steam_ids_per_minute",
+            field=models.PositiveIntegerField(
+                blank=True, help_text="Пусто - без ограничения", null=True, verbose_name="Steam ID в минуту"
+            ),
+        ),
+    ]
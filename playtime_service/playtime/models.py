@@ -1,3 +1,4 @@
+from django.core.validators import MinValueValidator
 from django.db import models
 
 
@@ -6,6 +7,7 @@ class Playtime(models.Model):
     game_id = models.IntegerField("Game ID")
     steam_playtime = models.IntegerField("Игровое время по Steam", null=True, blank=True)
     bm_playtime = models.IntegerField("Игровое время по Battlemetrics", null=True, blank=True)
+    bm_updated_at = models.DateTimeField("Время подписи последнего вебхука Battlemetrics", null=True, blank=True)
     created_at = models.DateTimeField("Дата создания", auto_now_add=True)
     updated_at = models.DateTimeField("Дата изменения", auto_now=True)
 
@@ -43,6 +45,28 @@ class PlaytimeGetPath(models.Model):
     path = models.CharField("Путь", max_length=255, unique=True)
     hmac_secret_key = models.CharField("HMAC ключ", max_length=255)
     fixed_game_id = models.IntegerField("Зафиксированный Game ID", null=True, blank=True)
+    default_deadline = models.FloatField(
+        "Дедлайн ожидания Steam по умолчанию (секунды)",
+        null=True,
+        blank=True,
+        help_text="Не успевшие за это время запросы в Steam отдаются из базы и сохраняются в фоне",
+    )
+    requests_per_second = models.FloatField(
+        "Запросов в секунду",
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(0.01)],
+        help_text="Пусто - без ограничения",
+    )
+    steam_ids_per_minute = models.PositiveIntegerField(
+        "Steam ID в минуту", null=True, blank=True, help_text="Пусто - без ограничения"
+    )
+    forced_refresh_ids_per_hour = models.PositiveIntegerField(
+        "Steam ID с is_need_update в час",
+        null=True,
+        blank=True,
+        help_text="Пусто - без ограничения, ограничивает принудительные обновления из Steam",
+    )
 
     class Meta:
         verbose_name = "'Подключение скриптов'"
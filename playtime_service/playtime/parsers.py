@@ -0,0 +1,23 @@
+import msgpack
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class MessagePackParser(BaseParser):
+    """
+    Разбирает тело запроса в формате MessagePack, HMAC при этом всё так же
+    считается от сырого тела запроса
+    """
+
+    media_type = "application/msgpack"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            data = msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, msgpack.UnpackException) as e:
+            raise ParseError(f"MessagePack parse error - {e}")
+
+        if not isinstance(data, dict):
+            raise ParseError("MessagePack body must be a map")
+
+        return data
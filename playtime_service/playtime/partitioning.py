@@ -0,0 +1,144 @@
+"""
+Секционирование таблицы игрового времени по game_id (LIST)
+
+Все строки сначала попадают в секцию по умолчанию, отдельные секции под
+каждый game_id создаются командой create_playtime_partitions
+
+Новая таблица строится по текущей (LIKE), первичный ключ, уникальные
+ограничения и индексы переносятся с теми же именами и колонками, только
+первичный ключ секционированной таблицы - (id, game_id), так как ключ
+секционирования должен входить в каждое уникальное ограничение. Уникальные
+ограничения без game_id секционировать нельзя, тогда таблица не меняется
+"""
+
+from django.db import connection, transaction
+
+from .models import Playtime
+
+
+def _table() -> str:
+    return Playtime._meta.db_table
+
+
+def is_playtime_partitioned() -> bool:
+    if connection.vendor != "postgresql":
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s AND relkind = 'p'", [_table()])
+        return cursor.fetchone() is not None
+
+
+def partition_playtime_table() -> None:
+    """Переводит таблицу в секционированную по game_id, все строки попадают в секцию по умолчанию
+
+    Выполняется в одной транзакции, на время переноса таблица недоступна
+    """
+    _rebuild_playtime_table(partitioned=True)
+
+
+def unpartition_playtime_table() -> None:
+    """Возвращает обычную таблицу с первичным ключом id"""
+    _rebuild_playtime_table(partitioned=False)
+
+
+def _rebuild_playtime_table(*, partitioned: bool) -> None:
+    qn = connection.ops.quote_name
+    table = _table()
+    new_table = f"{table}_rebuilt"
+    sequence = f"{table}_partitioned_id_seq"
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {qn(table)} IN ACCESS EXCLUSIVE MODE")
+
+        constraints = _get_constraints(cursor, table)
+        indexes = _get_indexes(cursor, table)
+
+        # Колонки, умолчания, CHECK и комментарии берутся из текущей таблицы, ключи и индексы добавляются после переноса
+        cursor.execute(
+            f"CREATE TABLE {qn(new_table)} (LIKE {qn(table)} INCLUDING ALL EXCLUDING INDEXES EXCLUDING IDENTITY)"
+            + (" PARTITION BY LIST (game_id)" if partitioned else "")
+        )
+        if partitioned:
+            cursor.execute(f"CREATE TABLE {qn(table + '_default')} PARTITION OF {qn(new_table)} DEFAULT")
+
+        # У секционированных таблиц до PostgreSQL 17 не бывает identity, id берётся из отдельной последовательности
+        cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {qn(sequence)}")
+        cursor.execute(f"ALTER TABLE {qn(new_table)} ALTER COLUMN id SET DEFAULT nextval(%s)", [sequence])
+
+        cursor.execute(f"INSERT INTO {qn(new_table)} SELECT * FROM {qn(table)}")
+        cursor.execute(f"SELECT setval(%s, COALESCE((SELECT MAX(id) FROM {qn(table)}), 0) + 1, false)", [sequence])
+        cursor.execute(f"ALTER SEQUENCE {qn(sequence)} OWNED BY {qn(new_table)}.id")
+
+        cursor.execute(f"DROP TABLE {qn(table)}")
+        cursor.execute(f"ALTER TABLE {qn(new_table)} RENAME TO {qn(table)}")
+
+        for name, constraint_type, definition in constraints:
+            if constraint_type == "p":
+                definition = "PRIMARY KEY (id, game_id)" if partitioned else "PRIMARY KEY (id)"
+            cursor.execute(f"ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}")
+
+        # Определения ссылаются на таблицу по имени, которое теперь у новой таблицы
+        for definition in indexes:
+            cursor.execute(definition)
+
+
+def _get_constraints(cursor, table: str) -> list[tuple[str, str, str]]:
+    """Первичный ключ и уникальные ограничения таблицы: (имя, тип, определение)"""
+    cursor.execute(
+        "SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint"
+        " WHERE conrelid = %s::regclass AND contype IN ('p', 'u')",
+        [table],
+    )
+    return cursor.fetchall()
+
+
+def _get_indexes(cursor, table: str) -> list[str]:
+    """CREATE INDEX индексов таблицы, которые не созданы ограничениями"""
+    cursor.execute(
+        "SELECT pg_get_indexdef(indexrelid) FROM pg_index"
+        " WHERE indrelid = %s::regclass"
+        " AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE pg_constraint.conindid = pg_index.indexrelid)",
+        [table],
+    )
+    return [definition for (definition,) in cursor.fetchall()]
+
+
+def get_partitioned_game_ids() -> set[int]:
+    """game_id у которых уже есть своя секция"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits"
+            " JOIN pg_class parent ON parent.oid = pg_inherits.inhparent"
+            " JOIN pg_class child ON child.oid = pg_inherits.inhrelid"
+            " WHERE parent.relname = %s",
+            [_table()],
+        )
+        prefix = f"{_table()}_game_"
+        return {int(name.removeprefix(prefix)) for (name,) in cursor.fetchall() if name.startswith(prefix)}
+
+
+def get_unpartitioned_game_ids() -> set[int]:
+    """game_id строки которых сейчас лежат в секции по умолчанию"""
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT DISTINCT game_id FROM {qn(_table() + '_default')}")
+        return {game_id for (game_id,) in cursor.fetchall()}
+
+
+def create_game_partition(game_id: int) -> None:
+    """Создает секцию для game_id и переносит в неё строки из секции по умолчанию
+
+    Выполняется в одной транзакции, на время переноса таблица блокируется
+    """
+    qn = connection.ops.quote_name
+    table = qn(_table())
+    default_partition = qn(f"{_table()}_default")
+    partition = qn(f"{_table()}_game_{int(game_id)}")
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE")
+        cursor.execute(f"CREATE TABLE {partition} (LIKE {table} INCLUDING DEFAULTS)")
+        cursor.execute(f"INSERT INTO {partition} SELECT * FROM {default_partition} WHERE game_id = %s", [game_id])
+        cursor.execute(f"DELETE FROM {default_partition} WHERE game_id = %s", [game_id])
+        cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {partition} FOR VALUES IN ({int(game_id)})")
@@ -0,0 +1,145 @@
+"""
+Фоновый запрос игрового времени из Steam для новых игроков
+
+Игроки, впервые пришедшие через вебхук Battlemetrics, ставятся в очередь и
+запрашиваются в Steam пачками в фоновом event loop, чтобы первый запрос
+игрового сервера уже находил время Steam в базе
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Awaitable, Callable
+
+from django.core.cache import cache
+
+from . import background, metrics
+from .rate_limits import TokenBucket
+
+_PREFETCH_CACHE_KEY = "steam_prefetch:{game_id}:{steam_id}"
+
+
+class SteamPrefetcher:
+    """Очередь игроков для фонового запроса в Steam
+
+    Один и тот же игрок ставится в очередь не чаще раза в dedupe_window секунд
+    (через кеш Django, с общим кешем - на все воркеры). Пачки запрашиваются
+    только если Steam доступен и у процесса есть свободные места под запросы
+    в Steam, и не больше max_per_minute игроков в минуту
+
+    Args:
+        fetch: Запрашивает и сохраняет игровое время пачки игроков одной игры
+        can_fetch: Можно ли сейчас запросить в Steam столько игроков
+    """
+
+    def __init__(
+        self,
+        *,
+        enabled: bool,
+        batch_size: int,
+        delay: float,
+        dedupe_window: int,
+        max_queue: int,
+        max_per_minute: int,
+        fetch: Callable[[int, list[str]], Awaitable[None]],
+        can_fetch: Callable[[int], bool],
+    ) -> None:
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.delay = delay
+        self.dedupe_window = dedupe_window
+        self.max_queue = max_queue
+        self.fetch = fetch
+        self.can_fetch = can_fetch
+
+        self._budget = TokenBucket(limit=max_per_minute, period=60)
+        self._lock = threading.Lock()
+        # game_id -> steam_id в порядке постановки в очередь
+        self._queue: dict[int, dict[str, None]] = {}
+        self._queued = 0
+        self._running = False
+
+        metrics.register_gauge("steam_prefetch_queued", lambda: self._queued)
+
+    def enqueue(self, *, steam_id: str, game_id: int) -> bool:
+        """Ставит игрока в очередь, возвращает False если он уже недавно ставился или очередь полна"""
+        if not self.enabled:
+            return False
+
+        cache_key = _PREFETCH_CACHE_KEY.format(game_id=game_id, steam_id=steam_id)
+        if not cache.add(cache_key, True, timeout=self.dedupe_window):
+            metrics.increment("steam_prefetch_enqueued", result="deduplicated")
+            return False
+
+        with self._lock:
+            if self._queued >= self.max_queue:
+                cache.delete(cache_key)
+                metrics.increment("steam_prefetch_enqueued", result="dropped")
+                return False
+
+            self._queue.setdefault(game_id, {})[steam_id] = None
+            self._queued += 1
+
+            start = not self._running
+            self._running = True
+
+        metrics.increment("steam_prefetch_enqueued", result="queued")
+
+        if start:
+            background.run_coroutine(self._run())
+
+        return True
+
+    async def _run(self) -> None:
+        """Разбирает очередь пачками, пока она не опустеет"""
+        wait = self.delay
+
+        while True:
+            # Даём накопиться пачке, а при нехватке бюджета - ждём его
+            await asyncio.sleep(wait)
+            wait = self.delay
+
+            batch = self._take_batch()
+            if batch is None:
+                return
+
+            game_id, steam_ids = batch
+
+            budget_wait = self._budget.wait_time(len(steam_ids), time.monotonic())
+            if budget_wait or not self.can_fetch(len(steam_ids)):
+                self._return_batch(game_id, steam_ids)
+                metrics.increment("steam_prefetch_deferred")
+                wait = max(budget_wait, self.delay)
+                continue
+
+            self._budget.consume(len(steam_ids))
+
+            try:
+                await self.fetch(game_id, steam_ids)
+            except Exception as e:
+                logging.error(f"Ошибка фонового запроса игрового времени {len(steam_ids)} игроков: {e}", exc_info=e)
+
+    def _take_batch(self) -> tuple[int, list[str]] | None:
+        with self._lock:
+            if not self._queue:
+                self._running = False
+                return None
+
+            game_id, steam_ids = next(iter(self._queue.items()))
+            batch = list(steam_ids)[: self.batch_size]
+
+            for steam_id in batch:
+                del steam_ids[steam_id]
+            if not steam_ids:
+                del self._queue[game_id]
+
+            self._queued -= len(batch)
+
+        return game_id, batch
+
+    def _return_batch(self, game_id: int, steam_ids: list[str]) -> None:
+        with self._lock:
+            queued = self._queue.pop(game_id, {})
+            self._queue[game_id] = dict.fromkeys(steam_ids) | queued
+            self._queued += len(self._queue[game_id]) - len(queued)
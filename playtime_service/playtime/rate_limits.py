@@ -0,0 +1,241 @@
+"""
+Ограничения частоты запросов и квоты подключений скриптов
+
+По умолчанию лимиты считаются token bucket'ами в памяти процесса, то есть
+на каждый воркер отдельно, там же считается использование для админки. С
+RATE_LIMITS.SHARED лимиты и использование считаются общими счётчиками в кеше
+Django (нужен общий для воркеров бэкенд кеша)
+"""
+
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Literal
+
+from django.core.cache import cache
+
+from . import metrics
+
+LimitName = Literal["requests", "steam_ids", "forced_refresh_ids"]
+
+LIMIT_NAMES: tuple[LimitName, ...] = ("requests", "steam_ids", "forced_refresh_ids")
+
+_COUNTER_CACHE_KEY = "rate_limit:{path_id}:{name}:{window}"
+_REJECTED_CACHE_KEY = "rate_limit_rejected:{path_id}:{name}"
+_REJECTED_CACHE_TTL = 24 * 60 * 60
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """Не больше limit единиц за period секунд, amount - сколько единиц тратит текущий запрос"""
+
+    name: LimitName
+    limit: float
+    period: float
+    amount: int = 1
+
+
+class TokenBucket:
+    """Token bucket на limit токенов, полностью восполняется за period секунд
+
+    Запрос больше всего ведра пропускается когда ведро полное и уводит его в минус,
+    иначе такой запрос не прошёл бы никогда
+    """
+
+    def __init__(self, *, limit: float, period: float) -> None:
+        self.limit = limit
+        self.period = period
+        self.rate = limit / period
+        self.tokens = limit
+        self.updated_at = time.monotonic()
+
+    def wait_time(self, amount: int, now: float) -> float:
+        """Через сколько секунд в ведре хватит токенов на amount, 0 - хватает сейчас"""
+        self.tokens = min(self.limit, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+        required = min(amount, self.limit)
+        if self.tokens >= required:
+            return 0
+
+        return (required - self.tokens) / self.rate
+
+    def consume(self, amount: int) -> None:
+        self.tokens -= amount
+
+
+class PathRateLimiter:
+    def __init__(self, *, shared: bool) -> None:
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._buckets: dict[tuple[int, LimitName], TokenBucket] = {}
+        # Использование без общего кеша: (окно, использовано) и (когда сбросить, отклонено)
+        self._usage: dict[tuple[int, LimitName], tuple[int, int]] = {}
+        self._rejected: dict[tuple[int, LimitName], tuple[float, int]] = {}
+
+    def acquire(self, *, path_id: int, limits: list[RateLimit]) -> float:
+        """Списывает запрос со всех лимитов подключения сразу
+
+        Returns:
+            float: 0 если запрос укладывается в лимиты, иначе через сколько секунд повторить
+        """
+        if not limits:
+            return 0
+
+        if self.shared:
+            retry_after = self._acquire_shared(path_id, limits)
+        else:
+            retry_after = self._acquire_local(path_id, limits)
+            if not retry_after:
+                self._count_usage(path_id, limits)
+
+        return retry_after
+
+    def _acquire_local(self, path_id: int, limits: list[RateLimit]) -> float:
+        now = time.monotonic()
+
+        with self._lock:
+            buckets = [(self._get_bucket(path_id, limit), limit) for limit in limits]
+
+            rejected_limit, wait_time = None, 0.0
+            for bucket, limit in buckets:
+                wait_time = bucket.wait_time(limit.amount, now)
+                if wait_time:
+                    rejected_limit = limit
+                    break
+            else:
+                for bucket, limit in buckets:
+                    bucket.consume(limit.amount)
+
+        if rejected_limit is not None:
+            self._count_rejected(path_id, rejected_limit)
+
+        return wait_time
+
+    def _get_bucket(self, path_id: int, limit: RateLimit) -> TokenBucket:
+        bucket = self._buckets.get((path_id, limit.name))
+
+        # Лимиты подключения поменяли в админке
+        if bucket is None or bucket.limit != limit.limit or bucket.period != limit.period:
+            bucket = self._buckets[(path_id, limit.name)] = TokenBucket(limit=limit.limit, period=limit.period)
+
+        return bucket
+
+    def _acquire_shared(self, path_id: int, limits: list[RateLimit]) -> float:
+        """Фиксированные окна на cache.incr: кеш Django атомарно увеличивает счётчик,
+        но не умеет compare-and-set, поэтому ведро целиком в нём не хранится
+        """
+        now = time.time()
+        acquired: list[str] = []
+
+        for limit in limits:
+            window = int(now // limit.period)
+            key = _COUNTER_CACHE_KEY.format(path_id=path_id, name=limit.name, window=window)
+
+            cache.add(key, 0, timeout=math.ceil(limit.period * 2))
+            count = cache.incr(key, limit.amount)
+            acquired.append(key)
+
+            # Первый запрос в окне проходит, даже если он один больше лимита
+            if count > limit.limit and count > limit.amount:
+                for acquired_key, acquired_limit in zip(acquired, limits):
+                    cache.decr(acquired_key, acquired_limit.amount)
+
+                self._count_rejected(path_id, limit)
+                return (window + 1) * limit.period - now
+
+        return 0
+
+    def _count_usage(self, path_id: int, limits: list[RateLimit]) -> None:
+        now = time.time()
+
+        with self._lock:
+            for limit in limits:
+                window = int(now // limit.period)
+                used_window, used = self._usage.get((path_id, limit.name), (window, 0))
+                self._usage[(path_id, limit.name)] = (window, (used if used_window == window else 0) + limit.amount)
+
+    def _count_rejected(self, path_id: int, limit: RateLimit) -> None:
+        metrics.increment("path_rate_limited", path_id=path_id, limit=limit.name)
+
+        if not self.shared:
+            now = time.time()
+            with self._lock:
+                reset_at, rejected = self._rejected.get((path_id, limit.name), (0, 0))
+                if now >= reset_at:
+                    reset_at, rejected = now + _REJECTED_CACHE_TTL, 0
+                self._rejected[(path_id, limit.name)] = (reset_at, rejected + 1)
+            return
+
+        key = _REJECTED_CACHE_KEY.format(path_id=path_id, name=limit.name)
+        cache.add(key, 0, timeout=_REJECTED_CACHE_TTL)
+        cache.incr(key)
+
+    def get_usage(self, playtime_path) -> dict[LimitName, tuple[int, int]]:
+        """Использование лимитов подключения в текущих окнах (секунда, минута, час) и отклонённые за сутки
+
+        Без общего кеша отражает только процесс, в котором вызван
+
+        Returns:
+            dict[LimitName, tuple[int, int]]: Для каждого лимита (использовано в окне, отклонено запросов)
+        """
+        now = time.time()
+        periods: dict[LimitName, float] = {
+            "requests": max(1, 1 / playtime_path.requests_per_second) if playtime_path.requests_per_second else 1,
+            "steam_ids": 60,
+            "forced_refresh_ids": 60 * 60,
+        }
+        windows = {name: int(now // periods[name]) for name in LIMIT_NAMES}
+
+        if not self.shared:
+            usage = {}
+            with self._lock:
+                for name in LIMIT_NAMES:
+                    window, used = self._usage.get((playtime_path.pk, name), (None, 0))
+                    reset_at, rejected = self._rejected.get((playtime_path.pk, name), (0, 0))
+                    usage[name] = (used if window == windows[name] else 0, rejected if now < reset_at else 0)
+            return usage
+
+        keys = {
+            name: (
+                _COUNTER_CACHE_KEY.format(path_id=playtime_path.pk, name=name, window=windows[name]),
+                _REJECTED_CACHE_KEY.format(path_id=playtime_path.pk, name=name),
+            )
+            for name in LIMIT_NAMES
+        }
+        values = cache.get_many([key for pair in keys.values() for key in pair])
+
+        return {
+            name: (values.get(used_key, 0), values.get(rejected_key, 0))
+            for name, (used_key, rejected_key) in keys.items()
+        }
+
+
+def get_path_rate_limits(playtime_path, *, steam_ids_count: int, is_need_update: bool) -> list[RateLimit]:
+    """Лимиты подключения скрипта, которые тратит запрос, незаданные лимиты не ограничивают"""
+    limits = []
+
+    if playtime_path.requests_per_second:
+        # Меньше одного запроса в секунду - одно место на 1 / rps секунд
+        if playtime_path.requests_per_second < 1:
+            limits.append(RateLimit(name="requests", limit=1, period=1 / playtime_path.requests_per_second))
+        else:
+            limits.append(RateLimit(name="requests", limit=playtime_path.requests_per_second, period=1))
+
+    if playtime_path.steam_ids_per_minute:
+        limits.append(
+            RateLimit(name="steam_ids", limit=playtime_path.steam_ids_per_minute, period=60, amount=steam_ids_count)
+        )
+
+    if playtime_path.forced_refresh_ids_per_hour and is_need_update:
+        limits.append(
+            RateLimit(
+                name="forced_refresh_ids",
+                limit=playtime_path.forced_refresh_ids_per_hour,
+                period=60 * 60,
+                amount=steam_ids_count,
+            )
+        )
+
+    return limits
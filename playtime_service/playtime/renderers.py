@@ -0,0 +1,36 @@
+import msgpack
+from rest_framework.renderers import BaseRenderer
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Компактный бинарный формат ответа для игровых серверов, выбирается
+    заголовком Accept: application/msgpack
+    """
+
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None) -> bytes:
+        if data is None:
+            return b""
+
+        # В ошибках валидации списков ключи - индексы элементов, а msgpack.unpackb
+        # по умолчанию принимает только строковые ключи, поэтому приводим их к строкам как JSON
+        response = (renderer_context or {}).get("response")
+        if response is not None and response.exception:
+            data = _stringify_keys(data)
+
+        return msgpack.packb(data, use_bin_type=True)
+
+
+def _stringify_keys(data):
+    if isinstance(data, dict):
+        return {str(key): _stringify_keys(value) for key, value in data.items()}
+
+    if isinstance(data, (list, tuple)):
+        return [_stringify_keys(value) for value in data]
+
+    return data
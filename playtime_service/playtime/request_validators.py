@@ -124,6 +124,8 @@ class TimestampRequestHMACValidator(DefaultRequestHMACValidator):
 
     Сигнатура из request.data формируется из данных в формате
     {timestamp}.{request.data}
+
+    После успешной валидации подписанный timestamp доступен в self.timestamp
     """
 
     def __init__(
@@ -140,6 +142,7 @@ class TimestampRequestHMACValidator(DefaultRequestHMACValidator):
 
         self.hmac_timestamp_regex = timestamp_regex
         self.hmac_timestamp_deviation: timedelta = timedelta(seconds=timestamp_deviation)
+        self.timestamp: datetime | None = None
 
     def _generate_signature_from_request(self, *, request: Request) -> str:
         now: datetime = datetime.now(timezone.utc)
@@ -163,6 +166,8 @@ class TimestampRequestHMACValidator(DefaultRequestHMACValidator):
         if not (now - self.hmac_timestamp_deviation < timestamp < now + self.hmac_timestamp_deviation):
             raise ValidationError("Timestamp is very old or very far in the future")
 
+        self.timestamp = timestamp
+
         return hmac.digest(
             self.secret_key.encode(),
             f"{timestamp_text}.".encode() + request.body,
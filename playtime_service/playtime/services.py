@@ -1,16 +1,166 @@
 import asyncio
-import logging
-from typing import Iterable
+import hashlib
+import threading
+from concurrent.futures import Future
+from concurrent.futures import wait as wait_futures
+from datetime import datetime
+from typing import TYPE_CHECKING, Callable, Iterable, Literal
 
 from asgiref.sync import async_to_sync
 from django.conf import settings
-from django.db import transaction
-from steam_playtime import SteamConnectAsync
-
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.http import quote_etag
+
+from . import background, metrics
+from .admission import AdmissionController
+from .db_router import pin_to_primary, read_with_fallback
+from .events import publish_playtime_changes
+from .failure_log import SteamFailureLog
 from .models import Playtime
+from .prefetch import SteamPrefetcher
+from .rate_limits import PathRateLimiter
+
+if TYPE_CHECKING:
+    from steam_playtime import CircuitBreaker, SteamConnectAsync, SteamKeyPool
+
+ConflictRule = Literal["max", "incoming", "existing"]
+
+_IMPORT_STAGING_TABLE = "playtime_import_staging"
+
+_STEAM_VISIBILITY_CACHE_KEY = "steam_visibility:{steam_id}"
+# communityvisibilitystate у открытого профиля, 1 - закрытый
+_STEAM_VISIBILITY_PUBLIC = 3
+
+# Как разрешать конфликт колонки при слиянии, existing - текущее значение в таблице, incoming - из импорта
+_IMPORT_CONFLICT_EXPRESSIONS: dict[str, str] = {
+    "max": "GREATEST({existing}, {incoming})",
+    "incoming": "COALESCE({incoming}, {existing})",
+    "existing": "COALESCE({existing}, {incoming})",
+}
+
+# Как схлопывать дубликаты одного игрока внутри самого импорта
+_IMPORT_AGGREGATE_EXPRESSIONS: dict[str, str] = {
+    "max": "MAX({column})",
+    "incoming": "(ARRAY_AGG({column} ORDER BY line DESC) FILTER (WHERE {column} IS NOT NULL))[1]",
+    "existing": "(ARRAY_AGG({column} ORDER BY line ASC) FILTER (WHERE {column} IS NOT NULL))[1]",
+}
+
+
+# Клиент Steam (aiohttp и т.д.) импортируется и создается при первом запросе в Steam, а не при старте воркера
+_steam_clients_lock = threading.Lock()
+_steam_circuit_breaker: "CircuitBreaker | None" = None
+_steam_key_pool: "SteamKeyPool | None" = None
+
+
+def _create_steam_circuit_breaker() -> "CircuitBreaker | None":
+    from steam_playtime import CircuitBreaker, CircuitState
+
+    if not settings.STEAM_CIRCUIT_BREAKER_ENABLE:
+        return None
+
+    circuit_breaker = CircuitBreaker(
+        window=settings.STEAM_CIRCUIT_BREAKER_WINDOW,
+        failure_rate=settings.STEAM_CIRCUIT_BREAKER_FAILURE_RATE,
+        minimum_calls=settings.STEAM_CIRCUIT_BREAKER_MINIMUM_CALLS,
+        open_timeout=settings.STEAM_CIRCUIT_BREAKER_OPEN_TIMEOUT,
+        half_open_calls=settings.STEAM_CIRCUIT_BREAKER_HALF_OPEN_CALLS,
+    )
+
+    metrics.register_gauge("steam_circuit_breaker_state", lambda: circuit_breaker.state.value)
+    metrics.register_gauge("steam_circuit_breaker_rejected_calls", lambda: circuit_breaker.rejected_calls)
+    for state in CircuitState:
+        metrics.register_gauge(
+            "steam_circuit_breaker_transitions",
+            lambda state=state: circuit_breaker.transitions[state],
+            state=state.value,
+        )
+
+    return circuit_breaker
+
+
+def _create_steam_key_pool() -> "SteamKeyPool":
+    from steam_playtime import SteamKeyPool
+
+    # Пул ключей считает лимиты в памяти процесса, поэтому лимиты ключа делятся между всеми процессами сервиса
+    processes = max(1, settings.STEAM_API_KEY_PROCESSES)
+    key_pool = SteamKeyPool(
+        keys=settings.STEAM_API_KEYS,
+        requests_per_second=settings.STEAM_API_KEY_REQUESTS_PER_SECOND / processes,
+        daily_limit=settings.STEAM_API_KEY_DAILY_LIMIT // processes,
+        cooldown=settings.STEAM_API_KEY_COOLDOWN,
+    )
+
+    for key in key_pool.keys:
+        for usage_name in ("day_requests", "requests", "errors", "rejected", "in_flight"):
+            metrics.register_gauge(
+                f"steam_api_key_{usage_name}",
+                lambda key=key, usage_name=usage_name: getattr(key, usage_name),
+                key=key.name,
+            )
+
+    return key_pool
+
+
+def get_steam_clients() -> tuple["CircuitBreaker | None", "SteamKeyPool"]:
+    """Circuit breaker и пул ключей Steam API процесса, создаются при первом обращении"""
+    global _steam_circuit_breaker, _steam_key_pool
+
+    with _steam_clients_lock:
+        if _steam_key_pool is None:
+            _steam_circuit_breaker = _create_steam_circuit_breaker()
+            _steam_key_pool = _create_steam_key_pool()
+
+    return _steam_circuit_breaker, _steam_key_pool  # type: ignore
+
+
+steam_failure_log = SteamFailureLog(
+    interval=settings.STEAM_FAILURE_LOG_INTERVAL, traceback_interval=settings.STEAM_FAILURE_LOG_TRACEBACK_INTERVAL
+)
+
+path_rate_limiter = PathRateLimiter(shared=settings.RATE_LIMITS_SHARED)
+
+admission_controller = AdmissionController(
+    enabled=settings.ADMISSION_ENABLE,
+    max_concurrent_requests=settings.ADMISSION_MAX_CONCURRENT_REQUESTS,
+    steam_share=settings.ADMISSION_STEAM_SHARE,
+    max_steam_lookups=settings.ADMISSION_MAX_STEAM_LOOKUPS,
+)
+
+
+def is_steam_available() -> bool:
+    """False если circuit breaker разомкнут и запросы в Steam сейчас не выполняются"""
+    if _steam_circuit_breaker is None:
+        return True
+
+    from steam_playtime import CircuitState
+
+    return _steam_circuit_breaker.state is not CircuitState.OPEN
+
+
+def _can_query_steam(steam_ids_count: int) -> bool:
+    return is_steam_available() and admission_controller.can_start_steam_lookups(steam_ids_count)
 
 
 def update_or_create_playtime(*, steam_id, game_id, steam_playtime=None, bm_playtime=None):
+    playtime, changed = _update_or_create_playtime(
+        steam_id=steam_id, game_id=game_id, steam_playtime=steam_playtime, bm_playtime=bm_playtime
+    )
+
+    if changed:
+        publish_playtime_changes(game_id=game_id, steam_ids=[steam_id])
+
+    return playtime
+
+
+def _update_or_create_playtime(*, steam_id, game_id, steam_playtime=None, bm_playtime=None) -> tuple[Playtime, bool]:
+    """Создает или обновляет запись без публикации изменения
+
+    Returns:
+        tuple[Playtime, bool]: Запись и была ли она создана или изменена
+    """
     # Минуты в секунды
     _steam_playtime = steam_playtime
     if steam_playtime is not None:
@@ -21,68 +171,356 @@ def update_or_create_playtime(*, steam_id, game_id, steam_playtime=None, bm_play
     )
 
     if created:
-        return playtime
+        return playtime, True
 
-    # Сохранение последних измененных данных если steam_id уже существовал
-    edited = False
-    if _steam_playtime is not None:
+    # Сохранение изменившихся данных если steam_id уже существовал, без изменений updated_at
+    # не сдвигается, чтобы ETag и changed_since не менялись от повторного обновления
+    changed = False
+    if _steam_playtime is not None and playtime.steam_playtime != _steam_playtime:
         playtime.steam_playtime = _steam_playtime
-        edited = True
-    if bm_playtime is not None:
+        changed = True
+    if bm_playtime is not None and playtime.bm_playtime != bm_playtime:
         playtime.bm_playtime = bm_playtime
-        edited = True
+        changed = True
 
-    if edited:
+    if changed:
         playtime.save()
 
-    return playtime
+    return playtime, changed
+
+
+def upsert_bm_playtime(*, steam_id: str, game_id: int, bm_playtime: int, signed_at: datetime | None) -> bool:
+    """Атомарно создает или обновляет время Battlemetrics одним
+    INSERT ... ON CONFLICT DO UPDATE
+
+    Вебхуки могут прийти не по порядку, поэтому обновление применяется только
+    если оно новее: по подписанному времени вебхука, а если его нет у одной из
+    сторон или оно совпадает - только если игровое время не уменьшилось
+
+    Если у игрока ещё нет времени Steam, он ставится в очередь фонового запроса в Steam
+
+    Args:
+        signed_at: Время из подписи HMAC вебхука, None если подпись не проверялась
+
+    Returns:
+        bool: True если запись создана или обновлена, False если обновление устарело и проигнорировано
+    """
+    table = connection.ops.quote_name(Playtime._meta.db_table)
+    now = timezone.now()
+
+    # Запись мимо ORM, роутер её не видит
+    pin_to_primary()
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} AS playtime"
+            " (steam_id, game_id, bm_playtime, bm_updated_at, created_at, updated_at)"
+            " VALUES (%s, %s, %s, %s, %s, %s)"
+            " ON CONFLICT (steam_id, game_id) DO UPDATE SET"
+            " bm_playtime = EXCLUDED.bm_playtime,"
+            " bm_updated_at = COALESCE(EXCLUDED.bm_updated_at, playtime.bm_updated_at),"
+            " updated_at = EXCLUDED.updated_at"
+            " WHERE CASE"
+            "  WHEN EXCLUDED.bm_updated_at IS NOT NULL AND playtime.bm_updated_at IS NOT NULL"
+            "   AND EXCLUDED.bm_updated_at <> playtime.bm_updated_at"
+            "  THEN EXCLUDED.bm_updated_at > playtime.bm_updated_at"
+            "  ELSE playtime.bm_playtime IS NULL OR EXCLUDED.bm_playtime >= playtime.bm_playtime"
+            " END"
+            " RETURNING steam_playtime",
+            [steam_id, game_id, bm_playtime, signed_at, now, now],
+        )
+        row = cursor.fetchone()
+        applied = row is not None
+
+    if applied:
+        publish_playtime_changes(game_id=game_id, steam_ids=[steam_id])
+
+        # Времени Steam у игрока ещё нет - запросим его заранее, до первого запроса игрового сервера
+        if row[0] is None:
+            steam_prefetcher.enqueue(steam_id=steam_id, game_id=game_id)
+
+    metrics.increment("bm_webhook_updates", result="applied" if applied else "ignored")
+
+    return applied
+
+
+async def retrieve_playtimes_from_steam(
+    *, steam_ids: list, game_id: int, on_result: Callable[[str, int | None], None] | None = None
+) -> dict[str, int | None]:
+    """Получает игровое время из Steam для всех steam_ids параллельно
+
+    Steam ID, для которых Steam не ответил (circuit breaker разомкнут, закончились
+    ключи, ошибка запроса), в результат не попадают, чтобы пустое время не
+    сохранилось в базу вместо настоящего
+
+    Args:
+        on_result: Вызывается для каждого steam_id сразу как только получен его результат
+
+    Returns:
+        dict[str, int | None]: Игровое время в минутах, None если игры у игрока нет или профиль закрыт
+    """
+    from steam_playtime import (
+        SteamConnectAsync,
+        SteamKeysExhaustedError,
+        SteamUnavailableError,
+    )
+
+    circuit_breaker, key_pool = get_steam_clients()
+    sca = SteamConnectAsync(key_pool=key_pool, timeout=settings.STEAM_API_TIMEOUT, circuit_breaker=circuit_breaker)
+
+    visible_steam_ids = set(steam_ids)
+    results: dict[str, int | None] = {}
+
+    async def retrieve_playtime(steam_id: str) -> None:
+        try:
+            if steam_id not in visible_steam_ids:
+                playtime = None
+            else:
+                playtime = await sca.get_game_playtime(steam_id=steam_id, game_id=game_id)
+        except SteamKeysExhaustedError:
+            metrics.increment("steam_requests_rejected_by_key_pool")
+            return
+        except SteamUnavailableError:
+            metrics.increment("steam_requests_rejected_by_circuit_breaker")
+            return
+        except Exception as e:
+            sca.failures.add(endpoint="get_game_playtime", error=e, steam_ids=[steam_id])
+            return
+
+        results[steam_id] = playtime
+        if on_result is not None:
+            on_result(steam_id, playtime)
+
+    try:
+        with admission_controller.track_steam_lookups(len(steam_ids)):
+            if settings.STEAM_PRIVACY_PREFILTER_ENABLE:
+                visible_steam_ids = await filter_visible_steam_ids(sca=sca, steam_ids=steam_ids)
+
+            await asyncio.gather(*(retrieve_playtime(steam_id) for steam_id in steam_ids))
+            return results
+    finally:
+        steam_failure_log.report(sca.failures, game_id=game_id, steam_ids_count=len(steam_ids))
+        await sca.close()
+
+
+async def filter_visible_steam_ids(*, sca: "SteamConnectAsync", steam_ids: list[str]) -> set[str]:
+    """Оставляет только steam_id с открытым профилем, у закрытых профилей
+    списки игр всё равно недоступны
+
+    Видимость берется из кеша, для остальных запрашивается через
+    GetPlayerSummaries, по 100 steam_id за запрос. Если Steam не ответил -
+    возвращает все steam_ids без фильтрации
+    """
+    cache_keys = {_STEAM_VISIBILITY_CACHE_KEY.format(steam_id=steam_id): steam_id for steam_id in steam_ids}
+    visibility: dict[str, int] = {
+        cache_keys[key]: state for key, state in (await cache.aget_many(cache_keys.keys())).items()
+    }
+    metrics.increment("steam_visibility_cache_hits", len(visibility))
+
+    unknown_steam_ids = [steam_id for steam_id in steam_ids if steam_id not in visibility]
+    if unknown_steam_ids:
+        from steam_playtime import SteamUnavailableError
+
+        try:
+            players = await sca.get_players_data(steam_ids=unknown_steam_ids)
+        except SteamUnavailableError:
+            players = None
+
+        if players is None:
+            return set(steam_ids)
+
+        players_visibility = {player["steamid"]: player.get("communityvisibilitystate") for player in players}
+        await cache.aset_many(
+            {
+                _STEAM_VISIBILITY_CACHE_KEY.format(steam_id=steam_id): state
+                for steam_id, state in players_visibility.items()
+            },
+            timeout=settings.STEAM_PRIVACY_PREFILTER_CACHE_TTL,
+        )
+        visibility |= players_visibility  # type: ignore
+
+    # Steam не возвращает несуществующие профили, их тоже не запрашиваем
+    visible_steam_ids = {steam_id for steam_id in steam_ids if visibility.get(steam_id) == _STEAM_VISIBILITY_PUBLIC}
+    metrics.increment("steam_private_profiles_skipped", len(steam_ids) - len(visible_steam_ids))
+
+    return visible_steam_ids
+
+
+def retrieve_playtimes_from_steam_within(
+    *, steam_ids: list[str], game_id: int, deadline: float | None
+) -> dict[str, int | None]:
+    """Получает игровое время из Steam, ожидая не дольше deadline секунд
+
+    Запросы не успевшие за deadline продолжают выполняться в фоне и сами
+    сохраняют свой результат в базу
+
+    Returns:
+        dict[str, int | None]: Результаты только тех steam_id, которые Steam успел вернуть
+    """
+    if deadline is None:
+        return async_to_sync(retrieve_playtimes_from_steam)(steam_ids=steam_ids, game_id=game_id)
+
+    futures: dict[str, Future] = {steam_id: Future() for steam_id in steam_ids}
+
+    def on_result(steam_id: str, playtime: int | None) -> None:
+        futures[steam_id].set_result(playtime)
+
+    def on_lookup_done(lookup: Future) -> None:
+        from steam_playtime import SteamUnavailableError
+
+        # Оставшиеся без результата steam_id Steam так и не вернул
+        for future in futures.values():
+            if not future.done():
+                future.set_exception(lookup.exception() or SteamUnavailableError())  # type: ignore
+
+    def on_late_result(steam_id: str, future: Future) -> None:
+        if future.exception() is None:
+            background.submit_db_task(
+                update_or_create_playtime, steam_id=steam_id, game_id=game_id, steam_playtime=future.result()
+            )
+
+    lookup = background.run_coroutine(
+        retrieve_playtimes_from_steam(steam_ids=steam_ids, game_id=game_id, on_result=on_result)
+    )
+    lookup.add_done_callback(on_lookup_done)
+
+    done, _ = wait_futures(futures.values(), timeout=deadline)
+
+    results = {}
+    for steam_id, future in futures.items():
+        if future in done:
+            if future.exception() is None:
+                results[steam_id] = future.result()
+        else:
+            metrics.increment("steam_lookups_past_deadline")
+            future.add_done_callback(lambda future, steam_id=steam_id: on_late_result(steam_id, future))
+
+    return results
+
+
+def get_playtimes_from_db(*, steam_ids: Iterable[str], game_id: int) -> list[Playtime]:
+    """Записи игроков из реплики, если она есть и запрос ещё ничего не записывал"""
+    return read_with_fallback(
+        lambda alias: list(Playtime.objects.using(alias).filter(steam_id__in=steam_ids, game_id=game_id))
+    )
 
 
-async def retrieve_playtimes_from_steam(*, steam_ids: list, game_id: int) -> list[int | None]:
-    sca = SteamConnectAsync(api_key=settings.STEAM_API_KEY, timeout=settings.STEAM_API_TIMEOUT)
+def _make_playtimes_etag(
+    *,
+    steam_ids: Iterable[str],
+    game_id: int,
+    last_updated_at: datetime | None,
+    count: int,
+    changed_since: datetime | None,
+) -> str:
+    state = ":".join(
+        [
+            str(game_id),
+            ",".join(sorted(set(steam_ids))),
+            last_updated_at.isoformat() if last_updated_at else "",
+            str(count),
+            changed_since.isoformat() if changed_since else "",
+        ]
+    )
+    return quote_etag(hashlib.sha1(state.encode()).hexdigest())
+
+
+def get_db_playtimes_etag(
+    *, steam_ids: Iterable[str], game_id: int, changed_since: datetime | None = None
+) -> tuple[str, bool]:
+    """ETag текущего состояния записей в базе, считается одним агрегирующим
+    запросом без выборки самих записей
+
+    Returns:
+        tuple[str, bool]: ETag и есть ли в базе все steam_ids
+    """
+    steam_ids_set = set(steam_ids)
+    state = read_with_fallback(
+        lambda alias: Playtime.objects.using(alias)
+        .filter(steam_id__in=steam_ids_set, game_id=game_id)
+        .aggregate(last_updated_at=Max("updated_at"), count=Count("id"))
+    )
 
-    tasks = []
-    for steam_id in steam_ids:
-        tasks.append(asyncio.create_task(sca.get_game_playtime(steam_id=steam_id, game_id=game_id)))
+    etag = _make_playtimes_etag(
+        steam_ids=steam_ids_set,
+        game_id=game_id,
+        last_updated_at=state["last_updated_at"],
+        count=state["count"],
+        changed_since=changed_since,
+    )
+    return etag, state["count"] == len(steam_ids_set)
+
+
+def get_playtimes_etag(
+    *, playtimes: Iterable[Playtime], steam_ids: Iterable[str], game_id: int, changed_since: datetime | None = None
+) -> str:
+    """ETag уже полученных записей, совпадает с get_db_playtimes_etag для тех же данных"""
+    saved_playtimes = [playtime for playtime in playtimes if playtime.pk is not None]
+
+    return _make_playtimes_etag(
+        steam_ids=steam_ids,
+        game_id=game_id,
+        last_updated_at=max((playtime.updated_at for playtime in saved_playtimes), default=None),
+        count=len(saved_playtimes),
+        changed_since=changed_since,
+    )
 
-    playtime_task_results: list[int | BaseException] = await asyncio.gather(*tasks, return_exceptions=True)
 
-    await sca.close()
+def filter_changed_since(*, playtimes: Iterable[Playtime], changed_since: datetime) -> list[Playtime]:
+    return [playtime for playtime in playtimes if playtime.updated_at and playtime.updated_at > changed_since]
 
-    for index, steam_id_with_result in enumerate(zip(steam_ids, playtime_task_results)):
-        steam_id, result = steam_id_with_result
-        if isinstance(result, Exception):
-            logging.error(f"Error fetching game playtime for steam_id {steam_id}: {result}", exc_info=result)
-            playtime_task_results[index] = None  # type: ignore
 
-    return playtime_task_results  # type: ignore
+def get_playtimes_without_steam(*, steam_ids: Iterable[str], game_id: int) -> list[Playtime]:
+    """Данные только из базы, для steam_id которых нет в базе возвращаются
+    несохраненные записи с пустым игровым временем, чтобы при следующем
+    запросе их время снова запросилось из Steam
+    """
+    steam_ids_set = set(steam_ids)
 
+    db_playtimes = get_playtimes_from_db(steam_ids=steam_ids_set, game_id=game_id)
+    not_founded_steam_ids = steam_ids_set.difference(playtime.steam_id for playtime in db_playtimes)
 
-def get_playtimes_from_db(*, steam_ids: Iterable[str], game_id: int):
-    return Playtime.objects.filter(steam_id__in=steam_ids, game_id=game_id)
+    return db_playtimes + [Playtime(steam_id=steam_id, game_id=game_id) for steam_id in not_founded_steam_ids]
 
 
 def get_playtime_with_update(*, steam_id: str, game_id: int):
-    new_steam_playtime = async_to_sync(retrieve_playtimes_from_steam)(steam_ids=[steam_id], game_id=game_id)[0]
+    new_steam_playtimes = async_to_sync(retrieve_playtimes_from_steam)(steam_ids=[steam_id], game_id=game_id)
+
+    if steam_id not in new_steam_playtimes:
+        return get_playtimes_without_steam(steam_ids=[steam_id], game_id=game_id)[0]
 
-    return update_or_create_playtime(steam_id=steam_id, game_id=game_id, steam_playtime=new_steam_playtime)
+    return update_or_create_playtime(steam_id=steam_id, game_id=game_id, steam_playtime=new_steam_playtimes[steam_id])
 
 
-def get_playtimes_with_update(*, steam_ids: Iterable[str], game_id: int):
+def get_playtimes_with_update(*, steam_ids: Iterable[str], game_id: int, deadline: float | None = None):
     unique_steam_ids = list(set(steam_ids))
-    new_steam_playtimes = async_to_sync(retrieve_playtimes_from_steam)(steam_ids=unique_steam_ids, game_id=game_id)
 
-    updated_playtimes = []
-    with transaction.atomic():
-        for steam_id, playtime in zip(unique_steam_ids, new_steam_playtimes):
-            updated_playtimes.append(
-                update_or_create_playtime(steam_id=steam_id, game_id=game_id, steam_playtime=playtime)
-            )
+    if not _can_query_steam(len(unique_steam_ids)):
+        return get_playtimes_without_steam(steam_ids=unique_steam_ids, game_id=game_id)
+
+    new_steam_playtimes = retrieve_playtimes_from_steam_within(
+        steam_ids=unique_steam_ids, game_id=game_id, deadline=deadline
+    )
+
+    updated_playtimes = _save_steam_playtimes(game_id=game_id, steam_playtimes=new_steam_playtimes)
+
+    # Не успевшие за deadline и оставшиеся без ответа Steam отдаются такими, какие они сейчас в базе
+    late_steam_ids = [steam_id for steam_id in unique_steam_ids if steam_id not in new_steam_playtimes]
+    if late_steam_ids:
+        updated_playtimes.extend(get_playtimes_without_steam(steam_ids=late_steam_ids, game_id=game_id))
 
     return updated_playtimes
 
 
-def get_playtimes_with_search_unknown(*, steam_ids: Iterable[str], game_id: int):
+def get_playtimes_with_search_unknown(
+    *, steam_ids: Iterable[str], game_id: int, deadline: float | None = None
+) -> tuple[list[Playtime], bool]:
+    """Данные из базы, отсутствующие в базе steam_id запрашиваются в Steam
+
+    Returns:
+        tuple[list[Playtime], bool]: Записи и был ли запрос в Steam отклонен из-за перегрузки процесса,
+                                     тогда отсутствующие в базе отдаются с пустым временем
+    """
     steam_ids_set = set(steam_ids)
 
     db_playtimes = get_playtimes_from_db(steam_ids=steam_ids_set, game_id=game_id)
@@ -90,19 +528,168 @@ def get_playtimes_with_search_unknown(*, steam_ids: Iterable[str], game_id: int)
     founded_steam_ids = [playtime.steam_id for playtime in db_playtimes]
 
     if len(steam_ids_set) == len(founded_steam_ids):
-        return db_playtimes
+        return db_playtimes, False
 
     not_founded_steam_ids = list(steam_ids_set.difference(founded_steam_ids))
 
-    new_playtimes_from_steam = async_to_sync(retrieve_playtimes_from_steam)(
-        steam_ids=not_founded_steam_ids, game_id=game_id
-    )
+    # Запрос допущен как чтение из базы, но за неизвестными игроками идёт в Steam
+    with admission_controller.reclassify_as_steam() as admitted:
+        if not admitted or not _can_query_steam(len(not_founded_steam_ids)):
+            empty_playtimes = [Playtime(steam_id=steam_id, game_id=game_id) for steam_id in not_founded_steam_ids]
+            # При недоступном Steam ответ и так помечается как unavailable
+            return db_playtimes + empty_playtimes, is_steam_available()
+
+        new_playtimes_from_steam = retrieve_playtimes_from_steam_within(
+            steam_ids=not_founded_steam_ids, game_id=game_id, deadline=deadline
+        )
+
+    new_db_playtimes = _save_steam_playtimes(game_id=game_id, steam_playtimes=new_playtimes_from_steam)
+
+    # Не успевшие за deadline отдаются с пустым временем, в базу их запишет фоновый запрос,
+    # оставшиеся без ответа Steam не сохраняются и будут запрошены снова
+    late_playtimes = [
+        Playtime(steam_id=steam_id, game_id=game_id)
+        for steam_id in not_founded_steam_ids
+        if steam_id not in new_playtimes_from_steam
+    ]
+
+    return db_playtimes + new_db_playtimes + late_playtimes, False
+
+
+async def prefetch_steam_playtimes(game_id: int, steam_ids: list[str]) -> None:
+    """Запрашивает игровое время пачки игроков из Steam и сохраняет найденное в фоне"""
+    playtimes = await retrieve_playtimes_from_steam(steam_ids=steam_ids, game_id=game_id)
+    found_playtimes = {steam_id: playtime for steam_id, playtime in playtimes.items() if playtime is not None}
+
+    metrics.increment("steam_prefetch_lookups", len(steam_ids))
+    metrics.increment("steam_prefetch_found", len(found_playtimes))
+
+    if found_playtimes:
+        background.submit_db_task(_save_steam_playtimes, game_id=game_id, steam_playtimes=found_playtimes)
+
+
+def _save_steam_playtimes(*, game_id: int, steam_playtimes: dict[str, int | None]) -> list[Playtime]:
+    """Сохраняет время Steam пачки игроков одной транзакцией, изменившиеся
+    игроки публикуются одним событием на всю пачку
+    """
+    playtimes = []
+    changed_steam_ids = []
 
-    new_db_playtimes = []
     with transaction.atomic():
-        for steam_id, playtime in zip(not_founded_steam_ids, new_playtimes_from_steam):
-            new_db_playtimes.append(
-                update_or_create_playtime(steam_id=steam_id, game_id=game_id, steam_playtime=playtime)
+        for steam_id, steam_playtime in steam_playtimes.items():
+            playtime, changed = _update_or_create_playtime(
+                steam_id=steam_id, game_id=game_id, steam_playtime=steam_playtime
             )
-
-    return list(db_playtimes) + new_db_playtimes
+            playtimes.append(playtime)
+            if changed:
+                changed_steam_ids.append(steam_id)
+
+        if changed_steam_ids:
+            publish_playtime_changes(game_id=game_id, steam_ids=changed_steam_ids)
+
+    return playtimes
+
+
+steam_prefetcher = SteamPrefetcher(
+    enabled=settings.STEAM_PREFETCH_ENABLE,
+    batch_size=settings.STEAM_PREFETCH_BATCH_SIZE,
+    delay=settings.STEAM_PREFETCH_DELAY,
+    dedupe_window=settings.STEAM_PREFETCH_DEDUPE_WINDOW,
+    max_queue=settings.STEAM_PREFETCH_MAX_QUEUE,
+    max_per_minute=settings.STEAM_PREFETCH_MAX_PER_MINUTE,
+    fetch=prefetch_steam_playtimes,
+    can_fetch=_can_query_steam,
+)
+
+
+def import_playtimes(
+    *,
+    rows: Iterable[tuple[str, int, int | None, int | None]],
+    steam_conflict: ConflictRule = "max",
+    bm_conflict: ConflictRule = "max",
+    dry_run: bool = False,
+    progress_every: int = 50_000,
+    on_progress: Callable[[int], None] | None = None,
+) -> dict[str, int]:
+    """Массовый импорт игрового времени через COPY во временную таблицу
+    и одно слияние INSERT ... ON CONFLICT DO UPDATE в Playtime
+
+    Работает только с PostgreSQL
+
+    Args:
+        rows: Строки (steam_id, game_id, steam_playtime, bm_playtime), время в секундах как в базе
+        steam_conflict: Правило разрешения конфликта для steam_playtime
+        bm_conflict: Правило разрешения конфликта для bm_playtime
+        dry_run: Выполнить импорт и откатить транзакцию
+        progress_every: Через сколько строк вызывать on_progress
+        on_progress: Вызывается с количеством уже скопированных строк
+
+    Returns:
+        dict[str, int]: Количество скопированных, созданных и обновленных записей
+    """
+    for rule in (steam_conflict, bm_conflict):
+        if rule not in _IMPORT_CONFLICT_EXPRESSIONS:
+            raise ValueError(f"Unknown conflict rule {rule}")
+
+    qn = connection.ops.quote_name
+    table = qn(Playtime._meta.db_table)
+
+    def conflict_expression(column: str, rule: str) -> str:
+        return _IMPORT_CONFLICT_EXPRESSIONS[rule].format(existing=f"{table}.{column}", incoming=f"EXCLUDED.{column}")
+
+    def aggregate_expression(column: str, rule: str) -> str:
+        return _IMPORT_AGGREGATE_EXPRESSIONS[rule].format(column=column)
+
+    pin_to_primary()
+
+    copied = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE {_IMPORT_STAGING_TABLE} ("
+            " line bigserial,"
+            " steam_id varchar(18) NOT NULL,"
+            " game_id integer NOT NULL,"
+            " steam_playtime integer,"
+            " bm_playtime integer"
+            ") ON COMMIT DROP"
+        )
+
+        with cursor.copy(
+            f"COPY {_IMPORT_STAGING_TABLE} (steam_id, game_id, steam_playtime, bm_playtime) FROM STDIN"
+        ) as copy:
+            for row in rows:
+                copy.write_row(row)
+                copied += 1
+                if on_progress is not None and copied % progress_every == 0:
+                    on_progress(copied)
+
+        if on_progress is not None and copied % progress_every != 0:
+            on_progress(copied)
+
+        cursor.execute(
+            "WITH merged AS ("
+            f" INSERT INTO {table} (steam_id, game_id, steam_playtime, bm_playtime, created_at, updated_at)"
+            " SELECT steam_id, game_id,"
+            f" {aggregate_expression('steam_playtime', steam_conflict)},"
+            f" {aggregate_expression('bm_playtime', bm_conflict)},"
+            " NOW(), NOW()"
+            f" FROM {_IMPORT_STAGING_TABLE}"
+            " GROUP BY steam_id, game_id"
+            " ON CONFLICT (steam_id, game_id) DO UPDATE SET"
+            f" steam_playtime = {conflict_expression('steam_playtime', steam_conflict)},"
+            f" bm_playtime = {conflict_expression('bm_playtime', bm_conflict)},"
+            " updated_at = NOW()"
+            " RETURNING (xmax = 0) AS inserted"
+            ") SELECT COUNT(*) FILTER (WHERE inserted), COUNT(*) FILTER (WHERE NOT inserted) FROM merged"
+        )
+        created, updated = cursor.fetchone()
+
+        if dry_run:
+            transaction.set_rollback(True)
+        else:
+            # Уведомления отправятся после коммита, подписчики перечитают игры целиком
+            cursor.execute(f"SELECT DISTINCT game_id FROM {_IMPORT_STAGING_TABLE}")
+            for (game_id,) in cursor.fetchall():
+                publish_playtime_changes(game_id=game_id, steam_ids=None)
+
+    return {"copied": copied, "created": created, "updated": updated}
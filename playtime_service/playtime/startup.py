@@ -0,0 +1,52 @@
+"""
+Прогрев процесса для gunicorn с preload_app
+
+Тяжелые модули импортируются один раз в master процессе и достаются
+воркерам через fork. Здесь не создается ничего, что нельзя переносить
+через fork: event loop, сессии aiohttp и соединения с базой создаются
+лениво уже в воркерах
+"""
+
+import importlib
+import time
+
+from django.db import connections
+from django.urls import get_resolver
+
+# Модули которые без preload импортируются только при первом запросе (в Steam, к API и т.д.)
+PRELOAD_MODULES = [
+    "steam_playtime",
+    "aiohttp",
+    "yarl",
+    "msgpack",
+    "dateutil.parser",
+    "rest_framework.views",
+    "rest_framework.serializers",
+    "playtime.services",
+    "playtime.views",
+    "settings.urls",
+]
+
+
+def preload_modules() -> float:
+    """Импортирует PRELOAD_MODULES и разбирает URLconf, который иначе
+    загружается при первом запросе воркера
+
+    Returns:
+        float: Затраченное время в секундах
+    """
+    started_at = time.perf_counter()
+
+    for module in PRELOAD_MODULES:
+        importlib.import_module(module)
+
+    get_resolver().url_patterns
+
+    return time.perf_counter() - started_at
+
+
+def close_connections_before_fork() -> None:
+    """Закрывает соединения с базой в master процессе, чтобы воркеры не
+    унаследовали один и тот же сокет
+    """
+    connections.close_all()
@@ -1,3 +1,407 @@
-from django.test import TestCase
+import asyncio
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import msgpack
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.response import Response
+
+from steam_playtime import (
+    CircuitBreaker,
+    CircuitState,
+    SteamConnectAsync,
+    SteamKeyPool,
+    SteamKeysExhaustedError,
+    SteamUnavailableError,
+)
+
+from . import db_router
+from .admission import AdmissionController
+from .db_router import ReplicaLagMonitor, get_read_database, read_with_fallback
+from .models import Playtime, PlaytimeGetPath
+from .rate_limits import PathRateLimiter, get_path_rate_limits
+from .renderers import MessagePackRenderer
+from .services import (
+    get_playtimes_from_db,
+    get_playtimes_with_update,
+    upsert_bm_playtime,
+)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("steam_playtime.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.breaker = CircuitBreaker(window=30, failure_rate=0.5, minimum_calls=4, open_timeout=30, half_open_calls=2)
+
+    def open_breaker(self):
+        for _ in range(4):
+            self.breaker.record_failure()
+
+    def test_opens_on_failure_rate(self):
+        self.breaker.record_success()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertIs(self.breaker.state, CircuitState.CLOSED)
+
+        self.breaker.record_failure()
+
+        self.assertIs(self.breaker.state, CircuitState.OPEN)
+        self.assertFalse(self.breaker.allow_request())
+
+    def test_stays_closed_below_minimum_calls(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+
+        self.assertIs(self.breaker.state, CircuitState.CLOSED)
+
+    def test_old_calls_leave_window(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+
+        self.now += 31
+        self.breaker.record_failure()
+
+        self.assertIs(self.breaker.state, CircuitState.CLOSED)
+
+    def test_half_open_after_timeout(self):
+        self.open_breaker()
+
+        self.now += 29
+        self.assertIs(self.breaker.state, CircuitState.OPEN)
+
+        self.now += 1
+        self.assertIs(self.breaker.state, CircuitState.HALF_OPEN)
+
+    def test_half_open_closes_after_successful_probes(self):
+        self.open_breaker()
+        self.now += 30
+
+        self.assertTrue(self.breaker.allow_request())
+        self.assertTrue(self.breaker.allow_request())
+        self.assertFalse(self.breaker.allow_request())
+
+        self.breaker.record_success()
+        self.assertIs(self.breaker.state, CircuitState.HALF_OPEN)
+        self.breaker.record_success()
+
+        self.assertIs(self.breaker.state, CircuitState.CLOSED)
+
+    def test_half_open_reopens_on_failure(self):
+        self.open_breaker()
+        self.now += 30
+
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.record_failure()
+
+        self.assertIs(self.breaker.state, CircuitState.OPEN)
+        self.assertFalse(self.breaker.allow_request())
+
+    def test_released_probe_frees_its_slot(self):
+        self.open_breaker()
+        self.now += 30
+
+        self.assertTrue(self.breaker.allow_request())
+        self.assertTrue(self.breaker.allow_request())
+        self.assertFalse(self.breaker.allow_request())
+
+        # Пробный запрос завершился без результата
+        self.breaker.release_request()
+
+        self.assertTrue(self.breaker.allow_request())
+
+    def test_exhausted_keys_do_not_take_probe_slot(self):
+        self.open_breaker()
+        self.now += 30
+
+        key_pool = SteamKeyPool(keys=["key"], cooldown=60)
+        key_pool.keys[0].cooldown_until = self.now + 60
+
+        async def request():
+            steam = SteamConnectAsync(timeout=1, key_pool=key_pool, circuit_breaker=self.breaker)
+            try:
+                async with steam._request("/", params={}):
+                    pass
+            finally:
+                await steam.close()
+
+        for _ in range(3):
+            with self.assertRaises(SteamKeysExhaustedError):
+                asyncio.run(request())
+
+        self.assertIs(self.breaker.state, CircuitState.HALF_OPEN)
+        self.assertTrue(self.breaker.allow_request())
+
+
+class SteamUnavailableResultTests(TestCase):
+    steam_ids = ["76561198000000001", "76561198000000002"]
+
+    def setUp(self):
+        patcher = mock.patch(
+            "playtime.services.get_steam_clients", return_value=(None, SteamKeyPool(keys=["key"], cooldown=60))
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def get_game_playtime(self, *, steam_id, game_id):
+        # Circuit breaker разомкнулся посреди запроса: первый игрок получен, второй уже нет
+        if steam_id == self.steam_ids[1]:
+            raise SteamUnavailableError
+        return 120
+
+    def test_unavailable_result_is_not_saved(self):
+        for deadline in (None, 5):
+            with self.subTest(deadline=deadline), mock.patch.object(
+                SteamConnectAsync, "get_game_playtime", self.get_game_playtime
+            ):
+                playtimes = get_playtimes_with_update(steam_ids=self.steam_ids, game_id=1, deadline=deadline)
+
+                self.assertEqual(
+                    {playtime.steam_id: playtime.steam_playtime for playtime in playtimes},
+                    {self.steam_ids[0]: 120 * 60, self.steam_ids[1]: None},
+                )
+                self.assertEqual(list(Playtime.objects.values_list("steam_id", flat=True)), [self.steam_ids[0]])
+
+
+class UpsertBattlemetricsPlaytimeTests(TestCase):
+    steam_id = "76561198000000001"
+
+    def setUp(self):
+        patcher = mock.patch("playtime.services.steam_prefetcher")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.signed_at = timezone.now()
+        self.upsert(bm_playtime=100, signed_at=self.signed_at)
+
+    def upsert(self, *, bm_playtime, signed_at):
+        return upsert_bm_playtime(steam_id=self.steam_id, game_id=1, bm_playtime=bm_playtime, signed_at=signed_at)
+
+    def assertBmPlaytime(self, bm_playtime):
+        self.assertEqual(Playtime.objects.get(steam_id=self.steam_id, game_id=1).bm_playtime, bm_playtime)
+
+    def test_older_webhook_is_ignored(self):
+        self.assertFalse(self.upsert(bm_playtime=200, signed_at=self.signed_at - timedelta(seconds=1)))
+        self.assertBmPlaytime(100)
+
+    def test_lower_playtime_without_newer_timestamp_is_ignored(self):
+        for signed_at in (self.signed_at, None):
+            with self.subTest(signed_at=signed_at):
+                self.assertFalse(self.upsert(bm_playtime=50, signed_at=signed_at))
+                self.assertBmPlaytime(100)
+
+    def test_newer_webhook_with_lower_playtime_is_applied(self):
+        self.assertTrue(self.upsert(bm_playtime=50, signed_at=self.signed_at + timedelta(seconds=1)))
+        self.assertBmPlaytime(50)
+
+
+class MessagePackRendererTests(SimpleTestCase):
+    def test_error_map_keys_are_strings(self):
+        response = Response({"steam_ids": {0: ["Неверный Steam ID"]}}, status=400)
+        response.exception = True
+
+        content = MessagePackRenderer().render(response.data, renderer_context={"response": response})
+
+        self.assertEqual(msgpack.unpackb(content), {"steam_ids": {"0": ["Неверный Steam ID"]}})
+
+
+@override_settings(ENABLE_HMAC_VALIDATION=False)
+class PlaytimeEtagTests(TestCase):
+    steam_ids = ["76561198000000001", "76561198000000002"]
+
+    def setUp(self):
+        PlaytimeGetPath.objects.create(path="server", enabled=True, hmac_secret_key="secret")
+
+        # Steam каждый раз возвращает одно и то же время в минутах
+        patcher = mock.patch(
+            "playtime.services.retrieve_playtimes_from_steam_within",
+            return_value={self.steam_ids[0]: 120, self.steam_ids[1]: 30},
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_playtime(self, **headers):
+        return self.client.post(
+            reverse("playtime-get", args=["server"]),
+            {"steam_ids": self.steam_ids, "game_id": 1, "is_need_update": True},
+            content_type="application/json",
+            headers=headers,
+        )
+
+    def test_repeated_refresh_with_same_values_is_not_modified(self):
+        first = self.get_playtime()
+        self.assertEqual(first.status_code, 200)
+
+        second = self.get_playtime(**{"If-None-Match": first["ETag"]})
+
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second["ETag"], first["ETag"])
+
+    def test_refresh_with_new_value_changes_etag(self):
+        first = self.get_playtime()
+
+        with mock.patch(
+            "playtime.services.retrieve_playtimes_from_steam_within",
+            return_value={self.steam_ids[0]: 121, self.steam_ids[1]: 30},
+        ):
+            second = self.get_playtime(**{"If-None-Match": first["ETag"]})
+
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second["ETag"], first["ETag"])
+
+    def test_refresh_publishes_changes_once_per_batch(self):
+        with mock.patch("playtime.services.publish_playtime_changes") as publish:
+            self.get_playtime()
+            self.get_playtime()
+
+        # Повторное обновление без изменений ничего не публикует
+        publish.assert_called_once()
+        self.assertEqual(publish.call_args.kwargs["game_id"], 1)
+        self.assertCountEqual(publish.call_args.kwargs["steam_ids"], self.steam_ids)
+
+
+@override_settings(ENABLE_HMAC_VALIDATION=False, ADMISSION_SHED_MODE="degrade")
+class AdmissionSheddingTests(TestCase):
+    def setUp(self):
+        PlaytimeGetPath.objects.create(path="server", enabled=True, hmac_secret_key="secret")
+        Playtime.objects.create(steam_id="76561198000000001", game_id=1, steam_playtime=60)
+
+        self.controller = AdmissionController(
+            enabled=True, max_concurrent_requests=2, steam_share=0.5, max_steam_lookups=100
+        )
+        for module in ("playtime.views", "playtime.services"):
+            patcher = mock.patch(f"{module}.admission_controller", self.controller)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        # Место под запросы в Steam уже занято
+        self.controller._requests = self.controller._steam_requests = 1
+
+    def get_playtime(self, *, is_need_update):
+        return self.client.post(
+            reverse("playtime-get", args=["server"]),
+            {"steam_ids": ["76561198000000001", "76561198000000002"], "game_id": 1, "is_need_update": is_need_update},
+            content_type="application/json",
+        )
+
+    def test_degraded_request_takes_db_slot(self):
+        with mock.patch.object(self.controller, "_release", wraps=self.controller._release) as release:
+            response = self.get_playtime(is_need_update=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Steam-Status"], "shed")
+        release.assert_called_once_with("db")
+
+    def test_degraded_request_without_db_slot_is_rejected(self):
+        self.controller._requests = 2
+
+        response = self.get_playtime(is_need_update=True)
+
+        self.assertEqual(response.status_code, 503)
+
+    def test_shed_unknown_players_lookup_is_marked(self):
+        response = self.get_playtime(is_need_update=False)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Steam-Status"], "shed")
+        self.assertEqual([row["steam_playtime"] for row in response.json()], [60, None])
+
+
+class PathRateLimiterTests(SimpleTestCase):
+    def test_local_limits_do_not_use_cache(self):
+        playtime_path = PlaytimeGetPath(pk=1, requests_per_second=2, steam_ids_per_minute=100)
+        limiter = PathRateLimiter(shared=False)
+
+        with mock.patch("playtime.rate_limits.cache") as cache:
+            retry_afters = [
+                limiter.acquire(
+                    path_id=1, limits=get_path_rate_limits(playtime_path, steam_ids_count=10, is_need_update=False)
+                )
+                for _ in range(3)
+            ]
+            usage = limiter.get_usage(playtime_path)
+
+        self.assertEqual(retry_afters[:2], [0, 0])
+        self.assertGreater(retry_afters[2], 0)
+        self.assertEqual(usage["requests"], (2, 1))
+        self.assertEqual(usage["steam_ids"], (20, 0))
+        self.assertFalse(cache.method_calls)
+
+    def test_requests_per_second_must_be_positive(self):
+        playtime_path = PlaytimeGetPath(path="server", hmac_secret_key="secret", requests_per_second=-1)
+
+        with self.assertRaises(ValidationError):
+            playtime_path.full_clean(validate_unique=False)
+
+
+# Реплика только для тестов маршрутизации - зеркало тестовой базы, поэтому тесты
+# не зависят от [POSTGRES.REPLICAS] и запускаются всегда
+REPLICA = "replica_test"
+connections.settings[REPLICA] = connections.settings[DEFAULT_DB_ALIAS] | {
+    "TEST": connections.settings[DEFAULT_DB_ALIAS]["TEST"] | {"MIRROR": DEFAULT_DB_ALIAS}
+}
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    databases = {DEFAULT_DB_ALIAS, REPLICA} if REPLICA else {DEFAULT_DB_ALIAS}
+
+    def setUp(self):
+        self.monitor = ReplicaLagMonitor(aliases=[REPLICA], max_lag=5, check_interval=60)
+        patcher = mock.patch.object(db_router, "replica_lag_monitor", self.monitor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        Playtime.objects.create(steam_id="76561198000000001", game_id=1, steam_playtime=60)
+
+        # Запись выше привязала чтения теста к основной базе
+        token = db_router._primary_pinned.set(False)
+        self.addCleanup(db_router._primary_pinned.reset, token)
+
+    def test_read_goes_to_replica(self):
+        with CaptureQueriesContext(connections[REPLICA]) as replica_queries:
+            playtimes = get_playtimes_from_db(steam_ids=["76561198000000001"], game_id=1)
+
+        self.assertEqual([playtime.steam_playtime for playtime in playtimes], [60])
+        self.assertEqual(len(replica_queries), 1)
+
+    def test_read_inside_atomic_goes_to_primary(self):
+        with transaction.atomic():
+            self.assertEqual(get_read_database(), DEFAULT_DB_ALIAS)
+
+    def test_read_after_write_goes_to_primary(self):
+        self.assertEqual(get_read_database(), REPLICA)
+
+        Playtime.objects.create(steam_id="76561198000000002", game_id=1)
+
+        self.assertEqual(get_read_database(), DEFAULT_DB_ALIAS)
+
+    def test_lagging_replica_is_not_used(self):
+        with mock.patch.object(self.monitor, "_check_lag", return_value=60):
+            self.assertEqual(get_read_database(), DEFAULT_DB_ALIAS)
+
+    def test_replica_error_falls_back_to_primary(self):
+        def read(alias):
+            if alias == REPLICA:
+                raise OperationalError("connection refused")
+            return alias
+
+        self.assertEqual(read_with_fallback(read), DEFAULT_DB_ALIAS)
+        # До следующей проверки отставания реплика не используется
+        self.assertEqual(get_read_database(), DEFAULT_DB_ALIAS)
+
+    def test_admin_changelist_redirect_is_not_rendered(self):
+        user = get_user_model().objects.create_superuser(username="admin", password="admin")
+        self.client.force_login(user)
+
+        response = self.client.get(reverse("admin:playtime_playtime_changelist"), {"game_id": "abc"})
+
+        self.assertEqual(response.status_code, 302)
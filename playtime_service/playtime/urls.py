@@ -1,10 +1,17 @@
 from django.urls import path
 
-from .views import BattleMetricsPlaytimeUpdateApi, PlaytimeGetApi
+from .views import (
+    BattleMetricsPlaytimeUpdateApi,
+    MetricsApi,
+    PlaytimeGetApi,
+    PlaytimeStreamApi,
+)
 
 urlpatterns = [
     path("get-playtime/<str:path>/", PlaytimeGetApi.as_view(), name="playtime-get"),
     path(
         "set-playtime/bm/<str:path>/", BattleMetricsPlaytimeUpdateApi.as_view(), name="battle-metrics-playtime-update"
     ),
+    path("stream-playtime/<str:path>/", PlaytimeStreamApi.as_view(), name="playtime-stream"),
+    path("metrics/", MetricsApi.as_view(), name="metrics"),
 ]
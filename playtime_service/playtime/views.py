@@ -1,24 +1,67 @@
-from typing import Any
+import asyncio
+import functools
+import json
+import math
+from typing import Any, AsyncIterator
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.http.request import MediaType
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.utils.http import parse_etags
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import serializers, status
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
+from . import metrics
+from .db_router import pin_to_primary
+from .events import playtime_changes_hub
 from .models import BattlemetricsSetPath, PlaytimeGetPath
+from .parsers import MessagePackParser
+from .rate_limits import get_path_rate_limits
+from .renderers import MessagePackRenderer
 from .request_validators import (
     DefaultRequestHMACValidator,
     TimestampRequestHMACValidator,
 )
 from .services import (
+    admission_controller,
+    filter_changed_since,
+    get_db_playtimes_etag,
+    get_playtimes_etag,
+    get_playtimes_from_db,
     get_playtimes_with_search_unknown,
     get_playtimes_with_update,
-    update_or_create_playtime,
+    get_playtimes_without_steam,
+    is_steam_available,
+    path_rate_limiter,
+    upsert_bm_playtime,
 )
 
 
+def overloaded_response() -> Response:
+    return Response(
+        status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": str(settings.ADMISSION_RETRY_AFTER)}
+    )
+
+
+class EpochDateTimeField(serializers.DateTimeField):
+    def to_representation(self, value):
+        return int(value.timestamp()) if value else None
+
+
 class BattleMetricsPlaytimeUpdateApi(APIView):
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES + [MessagePackParser]
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [MessagePackRenderer]
+
     class InputSerializer(serializers.Serializer):
         steam_id = serializers.RegexField(r"^76\d{15,16}$")
         playtime = serializers.IntegerField()
@@ -52,22 +95,32 @@ class BattleMetricsPlaytimeUpdateApi(APIView):
         serializer = self.InputSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        update_or_create_playtime(
-            steam_id=serializer.validated_data["steam_id"],  # type: ignore
-            game_id=serializer.validated_data["game_id"],  # type: ignore
-            bm_playtime=serializer.validated_data["playtime"],  # type: ignore
-        )
+        with admission_controller.admit("webhook") as admitted:
+            if not admitted:
+                return overloaded_response()
+
+            applied = upsert_bm_playtime(
+                steam_id=serializer.validated_data["steam_id"],  # type: ignore
+                game_id=serializer.validated_data["game_id"],  # type: ignore
+                bm_playtime=serializer.validated_data["playtime"],  # type: ignore
+                signed_at=validator.timestamp,
+            )
 
-        return Response(status=status.HTTP_200_OK)
+        return Response({"applied": applied}, status=status.HTTP_200_OK)
 
 
 class PlaytimeGetApi(APIView):
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES + [MessagePackParser]
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [MessagePackRenderer]
+
     class InputSerializer(serializers.Serializer):
         steam_ids = serializers.ListField(
             child=serializers.RegexField(r"^76\d{15,16}$"), allow_empty=False, max_length=120
         )
         game_id = serializers.IntegerField()
         is_need_update = serializers.BooleanField(default=False)
+        deadline = serializers.FloatField(min_value=0, required=False)
+        changed_since = serializers.DateTimeField(required=False)
 
     class OutputSerializer(serializers.Serializer):
         steam_id = serializers.CharField()
@@ -76,6 +129,13 @@ class PlaytimeGetApi(APIView):
         created_at = serializers.DateTimeField()
         updated_at = serializers.DateTimeField()
 
+    class CompactOutputSerializer(serializers.Serializer):
+        steam_id = serializers.CharField()
+        steam_playtime = serializers.IntegerField()
+        bm_playtime = serializers.IntegerField()
+        created_at = EpochDateTimeField()
+        updated_at = EpochDateTimeField()
+
     def __init__(self, **kwargs: Any) -> None:
         super().__init__(**kwargs)
         self.serializer_class = self.InputSerializer
@@ -99,15 +159,207 @@ class PlaytimeGetApi(APIView):
         serializer = self.InputSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        if serializer.validated_data["is_need_update"]:  # type: ignore
-            playtimes = get_playtimes_with_update(
-                steam_ids=serializer.validated_data["steam_ids"],  # type: ignore
-                game_id=serializer.validated_data["game_id"],  # type: ignore
+        is_need_update = serializer.validated_data["is_need_update"]  # type: ignore
+
+        retry_after = path_rate_limiter.acquire(
+            path_id=playtime_path.pk,
+            limits=get_path_rate_limits(
+                playtime_path,
+                steam_ids_count=len(serializer.validated_data["steam_ids"]),  # type: ignore
+                is_need_update=is_need_update,
+            ),
+        )
+        if retry_after:
+            return Response(
+                status=status.HTTP_429_TOO_MANY_REQUESTS, headers={"Retry-After": str(math.ceil(retry_after))}
             )
+
+        get_playtimes_response = functools.partial(
+            self._get_playtimes_response,
+            request,
+            steam_ids=serializer.validated_data["steam_ids"],  # type: ignore
+            game_id=serializer.validated_data["game_id"],  # type: ignore
+            changed_since=serializer.validated_data.get("changed_since"),  # type: ignore
+            deadline=serializer.validated_data.get("deadline", playtime_path.default_deadline),  # type: ignore
+            is_need_update=is_need_update,
+        )
+
+        with admission_controller.admit("steam" if is_need_update else "db") as admitted:
+            if admitted:
+                return get_playtimes_response(is_steam_shed=False)
+
+        if not is_need_update or settings.ADMISSION_SHED_MODE == "reject":
+            return overloaded_response()
+
+        # Запрос в Steam не допущен - ответ из базы занимает место как обычное чтение
+        with admission_controller.admit("db") as admitted:
+            if not admitted:
+                return overloaded_response()
+
+            return get_playtimes_response(is_steam_shed=True)
+
+    def _get_playtimes_response(
+        self, request, *, steam_ids, game_id, changed_since, deadline, is_need_update, is_steam_shed
+    ) -> Response:
+        if_none_match = request.headers.get("If-None-Match")
+
+        # Если все игроки уже в базе и там ничего не изменилось - отвечаем без выборки и сериализации
+        if if_none_match and not is_need_update:
+            etag, all_found = get_db_playtimes_etag(steam_ids=steam_ids, game_id=game_id, changed_since=changed_since)
+            if all_found and etag in parse_etags(if_none_match):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        if is_steam_shed:
+            # Процесс перегружен запросами в Steam - отвечаем из базы
+            playtimes = get_playtimes_without_steam(steam_ids=steam_ids, game_id=game_id)
+        elif is_need_update:
+            playtimes = get_playtimes_with_update(steam_ids=steam_ids, game_id=game_id, deadline=deadline)
         else:
-            playtimes = get_playtimes_with_search_unknown(
-                steam_ids=serializer.validated_data["steam_ids"],  # type: ignore
-                game_id=serializer.validated_data["game_id"],  # type: ignore
+            playtimes, is_steam_shed = get_playtimes_with_search_unknown(
+                steam_ids=steam_ids, game_id=game_id, deadline=deadline
             )
 
-        return Response(self.OutputSerializer(playtimes, many=True).data)
+        etag = get_playtimes_etag(
+            playtimes=playtimes, steam_ids=steam_ids, game_id=game_id, changed_since=changed_since
+        )
+
+        headers = {"ETag": etag}
+        if is_steam_shed:
+            headers["X-Steam-Status"] = "shed"
+        elif not is_steam_available():
+            headers["X-Steam-Status"] = "unavailable"
+
+        if if_none_match and etag in parse_etags(if_none_match):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        if changed_since is not None:
+            playtimes = filter_changed_since(playtimes=playtimes, changed_since=changed_since)
+
+        return Response(self._serialize_playtimes(request, playtimes), headers=headers)
+
+    def _serialize_playtimes(self, request, playtimes):
+        if request.accepted_renderer.format != MessagePackRenderer.format:
+            return self.OutputSerializer(playtimes, many=True).data
+
+        rows = self.CompactOutputSerializer(playtimes, many=True).data
+
+        # Accept: application/msgpack; layout=columnar - параллельные массивы вместо списка объектов
+        if MediaType(request.accepted_media_type).params.get("layout") == "columnar":
+            return {field: [row[field] for row in rows] for field in self.CompactOutputSerializer().fields}
+
+        return rows
+
+
+class MetricsApi(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(metrics.snapshot())
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class PlaytimeStreamApi(View):
+    """Поток server-sent events с изменениями игрового времени, работает только под ASGI
+
+    Событие playtime - список изменившихся записей в формате get-playtime,
+    событие resync - изменилось много игроков или часть событий потеряна, игру нужно перечитать
+    """
+
+    class InputSerializer(serializers.Serializer):
+        steam_ids = serializers.ListField(
+            child=serializers.RegexField(r"^76\d{15,16}$"), allow_empty=False, max_length=1000, required=False
+        )
+        game_id = serializers.IntegerField()
+
+    async def post(self, request, path):
+        if not settings.PLAYTIME_EVENTS_ENABLE:
+            raise Http404
+
+        playtime_path = await PlaytimeGetPath.objects.filter(path=path).afirst()
+
+        if playtime_path is None:
+            raise Http404
+
+        if not playtime_path.enabled:
+            return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+
+        validator = DefaultRequestHMACValidator(
+            header="X-Signature", hash_type="sha256", secret_key=playtime_path.hmac_secret_key, signature_regex=".*"
+        )
+
+        try:
+            if settings.ENABLE_HMAC_VALIDATION:
+                validator.validate_hmac(request=request)
+
+            data = json.loads(request.body)
+        except ValidationError as e:
+            return JsonResponse(e.detail, status=status.HTTP_400_BAD_REQUEST, safe=False)
+        except ValueError:
+            return JsonResponse({"detail": "JSON parse error"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not isinstance(data, dict):
+            return JsonResponse({"detail": "JSON object required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if playtime_path.fixed_game_id is not None:
+            data["game_id"] = playtime_path.fixed_game_id
+
+        serializer = self.InputSerializer(data=data)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        if len(playtime_changes_hub.subscriptions) >= settings.PLAYTIME_EVENTS_MAX_SUBSCRIBERS:
+            return HttpResponse(
+                status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": str(settings.ADMISSION_RETRY_AFTER)}
+            )
+
+        return StreamingHttpResponse(
+            self._stream(
+                game_id=serializer.validated_data["game_id"],  # type: ignore
+                steam_ids=serializer.validated_data.get("steam_ids"),  # type: ignore
+            ),
+            content_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    async def _stream(self, *, game_id: int, steam_ids: list[str] | None) -> AsyncIterator[str]:
+        # Подписка создаётся в генераторе, чтобы отписка в finally выполнилась для любой созданной подписки,
+        # даже если клиент отключился до начала потока
+        subscription = playtime_changes_hub.subscribe(game_id=game_id, steam_ids=steam_ids)
+        metrics.increment("playtime_event_streams_opened")
+
+        # События приходят после коммита в основной базе, реплика может их ещё не видеть
+        pin_to_primary()
+
+        try:
+            yield f"retry: {settings.PLAYTIME_EVENTS_RETRY * 1000}\n\n"
+
+            while True:
+                try:
+                    steam_ids = await asyncio.wait_for(
+                        subscription.queue.get(), timeout=settings.PLAYTIME_EVENTS_KEEPALIVE
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+
+                # Всё, что накопилось в очереди, отправляется одним событием
+                changed = set(steam_ids) if steam_ids is not None else None
+                while not subscription.queue.empty():
+                    steam_ids = subscription.queue.get_nowait()
+                    if changed is None or steam_ids is None:
+                        changed = None
+                    else:
+                        changed.update(steam_ids)
+
+                if changed is None or subscription.need_resync:
+                    subscription.need_resync = False
+                    yield self._format_event("resync", {"game_id": subscription.game_id})
+                    continue
+
+                playtimes = await sync_to_async(get_playtimes_from_db)(steam_ids=changed, game_id=subscription.game_id)
+                yield self._format_event("playtime", PlaytimeGetApi.OutputSerializer(playtimes, many=True).data)
+        finally:
+            playtime_changes_hub.unsubscribe(subscription)
+
+    def _format_event(self, event: str, data) -> str:
+        return f"event: {event}\ndata: {JSONRenderer().render(data).decode()}\n\n"
@@ -20,15 +20,13 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
-    "debug_toolbar",
     "rest_framework",
     "playtime",
 ]
 
 MIDDLEWARE = [
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
-    #
     "django.middleware.security.SecurityMiddleware",
+    "playtime.db_router.ReplicaRoutingMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -68,6 +66,30 @@ DATABASES = {
     }
 }
 
+# Реплики для чтения, каждая берёт настройки основной базы и переопределяет указанные ключи
+_replicas_config = _config["POSTGRES"].get("REPLICAS", {})
+DATABASE_REPLICAS = []
+for _index, _replica_config in enumerate(_replicas_config.get("DATABASES", []), start=1):
+    _alias = f"replica_{_index}"
+    DATABASES[_alias] = DATABASES["default"] | {
+        "NAME": _replica_config.get("DATABASE_NAME", DATABASES["default"]["NAME"]),
+        "USER": _replica_config.get("USER", DATABASES["default"]["USER"]),
+        "PASSWORD": _replica_config.get("PASSWORD", DATABASES["default"]["PASSWORD"]),
+        "HOST": _replica_config.get("HOST", DATABASES["default"]["HOST"]),
+        "PORT": _replica_config.get("PORT", DATABASES["default"]["PORT"]),
+        # Проверка отставания идёт прямо в запросе, поэтому недоступная реплика не должна его надолго задерживать
+        "OPTIONS": (
+            DATABASES["default"].get("OPTIONS", {}) | {"connect_timeout": _replicas_config.get("CONNECT_TIMEOUT", 2)}
+        ),
+        # В тестах реплика - та же тестовая база
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(_alias)
+
+DATABASE_REPLICA_MAX_LAG = _replicas_config.get("MAX_LAG", 5)
+DATABASE_REPLICA_LAG_CHECK_INTERVAL = _replicas_config.get("LAG_CHECK_INTERVAL", 5)
+DATABASE_ROUTERS = ["playtime.db_router.ReplicaRouter"]
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
@@ -98,12 +120,80 @@ STATIC_ROOT = BASE_DIR / "static"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 # DEBUG TOOLBAR
+# Подключается только в DEBUG, чтобы не импортировать его при каждом старте воркера в проде
+if DEBUG:
+    INSTALLED_APPS.append("debug_toolbar")
+    MIDDLEWARE.insert(0, "debug_toolbar.middleware.DebugToolbarMiddleware")
+
 DEBUG_TOOLBAR_CONFIG = {"SHOW_TOOLBAR_CALLBACK": lambda request: DEBUG}
 
 # STEAM API
 STEAM_API_KEY = _config["STEAM"]["KEY"]
+STEAM_API_KEYS = _config["STEAM"].get("KEYS") or [STEAM_API_KEY]
 STEAM_API_TIMEOUT = _config["STEAM"]["TIMEOUT"]
 
+_steam_key_limits_config = _config["STEAM"].get("KEY_LIMITS", {})
+STEAM_API_KEY_REQUESTS_PER_SECOND = _steam_key_limits_config.get("REQUESTS_PER_SECOND", 0)
+STEAM_API_KEY_DAILY_LIMIT = _steam_key_limits_config.get("DAILY_LIMIT", 100_000)
+STEAM_API_KEY_COOLDOWN = _steam_key_limits_config.get("COOLDOWN", 60)
+STEAM_API_KEY_PROCESSES = _steam_key_limits_config.get("PROCESSES", 1)
+
+_steam_circuit_breaker_config = _config["STEAM"].get("CIRCUIT_BREAKER", {})
+STEAM_CIRCUIT_BREAKER_ENABLE = _steam_circuit_breaker_config.get("ENABLE", True)
+STEAM_CIRCUIT_BREAKER_WINDOW = _steam_circuit_breaker_config.get("WINDOW", 30)
+STEAM_CIRCUIT_BREAKER_FAILURE_RATE = _steam_circuit_breaker_config.get("FAILURE_RATE", 0.5)
+STEAM_CIRCUIT_BREAKER_MINIMUM_CALLS = _steam_circuit_breaker_config.get("MINIMUM_CALLS", 20)
+STEAM_CIRCUIT_BREAKER_OPEN_TIMEOUT = _steam_circuit_breaker_config.get("OPEN_TIMEOUT", 30)
+STEAM_CIRCUIT_BREAKER_HALF_OPEN_CALLS = _steam_circuit_breaker_config.get("HALF_OPEN_CALLS", 3)
+
+_steam_privacy_prefilter_config = _config["STEAM"].get("PRIVACY_PREFILTER", {})
+STEAM_PRIVACY_PREFILTER_ENABLE = _steam_privacy_prefilter_config.get("ENABLE", False)
+STEAM_PRIVACY_PREFILTER_CACHE_TTL = _steam_privacy_prefilter_config.get("CACHE_TTL", 3600)
+
+_steam_failure_log_config = _config["STEAM"].get("FAILURE_LOG", {})
+STEAM_FAILURE_LOG_INTERVAL = _steam_failure_log_config.get("INTERVAL", 60)
+STEAM_FAILURE_LOG_TRACEBACK_INTERVAL = _steam_failure_log_config.get("TRACEBACK_INTERVAL", 600)
+
+_steam_prefetch_config = _config["STEAM"].get("PREFETCH", {})
+STEAM_PREFETCH_ENABLE = _steam_prefetch_config.get("ENABLE", False)
+STEAM_PREFETCH_BATCH_SIZE = _steam_prefetch_config.get("BATCH_SIZE", 50)
+STEAM_PREFETCH_DELAY = _steam_prefetch_config.get("DELAY", 2)
+STEAM_PREFETCH_DEDUPE_WINDOW = _steam_prefetch_config.get("DEDUPE_WINDOW", 3600)
+STEAM_PREFETCH_MAX_QUEUE = _steam_prefetch_config.get("MAX_QUEUE", 10_000)
+STEAM_PREFETCH_MAX_PER_MINUTE = _steam_prefetch_config.get("MAX_PER_MINUTE", 300)
+
+# ADMISSION CONTROL
+_admission_config = _config.get("ADMISSION", {})
+ADMISSION_ENABLE = _admission_config.get("ENABLE", True)
+ADMISSION_MAX_CONCURRENT_REQUESTS = _admission_config.get("MAX_CONCURRENT_REQUESTS", 16)
+ADMISSION_STEAM_SHARE = _admission_config.get("STEAM_SHARE", 0.75)
+ADMISSION_MAX_STEAM_LOOKUPS = _admission_config.get("MAX_STEAM_LOOKUPS", 500)
+ADMISSION_SHED_MODE = _admission_config.get("SHED_MODE", "degrade")
+ADMISSION_RETRY_AFTER = _admission_config.get("RETRY_AFTER", 5)
+
+# CACHE
+# По умолчанию кеш в памяти процесса, для общих лимитов подключений нужен общий бэкенд
+_cache_config = _config.get("CACHE", {})
+CACHES = {
+    "default": {
+        "BACKEND": _cache_config.get("BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": _cache_config.get("LOCATION", ""),
+    }
+}
+
+# RATE LIMITS
+# Сами лимиты задаются у каждого подключения скриптов в админке
+_rate_limits_config = _config.get("RATE_LIMITS", {})
+RATE_LIMITS_SHARED = _rate_limits_config.get("SHARED", False)
+
+# PLAYTIME EVENTS
+_events_config = _config.get("EVENTS", {})
+PLAYTIME_EVENTS_ENABLE = _events_config.get("ENABLE", False)
+PLAYTIME_EVENTS_KEEPALIVE = _events_config.get("KEEPALIVE", 15)
+PLAYTIME_EVENTS_RETRY = _events_config.get("RETRY", 5)
+PLAYTIME_EVENTS_QUEUE_SIZE = _events_config.get("QUEUE_SIZE", 1000)
+PLAYTIME_EVENTS_MAX_SUBSCRIBERS = _events_config.get("MAX_SUBSCRIBERS", 1000)
+
 BATTLEMETRICS_SIGNATURE_REGEX = r"(?<=s=)\w+(?=,|\Z)"
 BATTLEMETRICS_TIMESTAMP_REGEX = r"(?<=t=)[\w\-:.+]+(?=,|\Z)"
 HMAC_TIMESTAMP_DEVIATION = _config["HMAC"]["TIMESTAMP_DEVIATION"]
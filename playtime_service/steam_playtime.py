@@ -1,6 +1,12 @@
 import asyncio
+import enum
 import logging
-from typing import Sequence
+import threading
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timezone
+from typing import AsyncIterator, Sequence
 
 import aiohttp
 import yarl
@@ -8,11 +14,357 @@ import yarl
 _STEAM_PLAYER_API_BASE_URL = yarl.URL("https://api.steampowered.com/")
 
 
+class SteamUnavailableError(Exception):
+    """Запрос к Steam не выполнялся, так как circuit breaker разомкнут"""
+
+
+class SteamKeysExhaustedError(SteamUnavailableError):
+    """Нет ни одного ключа Steam API с доступным лимитом запросов"""
+
+
+class CircuitState(enum.Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Circuit breaker для запросов к Steam API, общий для всех экземпляров
+    SteamConnectAsync в процессе
+
+    CLOSED - запросы идут как обычно, результаты пишутся в скользящее окно
+    в window секунд. Если в окне набралось хотя бы minimum_calls запросов и
+    доля ошибок и таймаутов не меньше failure_rate - переходит в OPEN
+
+    OPEN - запросы к Steam не выполняются, через open_timeout секунд
+    переходит в HALF_OPEN
+
+    HALF_OPEN - пропускает не больше half_open_calls пробных запросов,
+    если все они успешны - CLOSED, при первой ошибке снова OPEN. Каждый
+    пропущенный запрос должен закончиться record_success, record_failure
+    или release_request, иначе пробное место останется занятым
+    """
+
+    def __init__(
+        self,
+        *,
+        window: float = 30,
+        failure_rate: float = 0.5,
+        minimum_calls: int = 20,
+        open_timeout: float = 30,
+        half_open_calls: int = 3,
+    ) -> None:
+        self.window = window
+        self.failure_rate = failure_rate
+        self.minimum_calls = minimum_calls
+        self.open_timeout = open_timeout
+        self.half_open_calls = half_open_calls
+
+        self._lock = threading.Lock()
+        self._state = CircuitState.CLOSED
+        self._opened_at = 0.0
+        self._calls: deque[tuple[float, bool]] = deque()
+        self._half_open_started = 0
+        self._half_open_succeeded = 0
+
+        self.rejected_calls = 0
+        self.transitions: dict[CircuitState, int] = {state: 0 for state in CircuitState}
+
+    @property
+    def state(self) -> CircuitState:
+        with self._lock:
+            self._refresh_state()
+            return self._state
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            self._refresh_state()
+
+            if self._state is CircuitState.CLOSED:
+                return True
+
+            if self._state is CircuitState.HALF_OPEN and self._half_open_started < self.half_open_calls:
+                self._half_open_started += 1
+                return True
+
+            self.rejected_calls += 1
+            return False
+
+    def is_rejecting(self) -> bool:
+        """True если запрос сейчас точно не будет пропущен, пробное место не занимает"""
+        with self._lock:
+            self._refresh_state()
+
+            rejecting = self._state is CircuitState.OPEN or (
+                self._state is CircuitState.HALF_OPEN and self._half_open_started >= self.half_open_calls
+            )
+            if rejecting:
+                self.rejected_calls += 1
+
+            return rejecting
+
+    def release_request(self) -> None:
+        """Возвращает пробное место запроса, который завершился без результата (отменен и т.д.)"""
+        with self._lock:
+            if self._state is CircuitState.HALF_OPEN and self._half_open_started > 0:
+                self._half_open_started -= 1
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state is CircuitState.HALF_OPEN:
+                self._half_open_succeeded += 1
+                if self._half_open_succeeded >= self.half_open_calls:
+                    self._transition(CircuitState.CLOSED)
+                return
+
+            self._append_call(True)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            if self._state is CircuitState.HALF_OPEN:
+                self._transition(CircuitState.OPEN)
+                return
+
+            self._append_call(False)
+
+            if len(self._calls) < self.minimum_calls:
+                return
+
+            failures = sum(1 for _, success in self._calls if not success)
+            if failures / len(self._calls) >= self.failure_rate:
+                self._transition(CircuitState.OPEN)
+
+    def _append_call(self, success: bool) -> None:
+        now = time.monotonic()
+        self._calls.append((now, success))
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+
+    def _refresh_state(self) -> None:
+        if self._state is CircuitState.OPEN and time.monotonic() - self._opened_at >= self.open_timeout:
+            self._transition(CircuitState.HALF_OPEN)
+
+    def _transition(self, state: CircuitState) -> None:
+        logging.warning(f"Circuit breaker Steam API: {self._state.value} -> {state.value}")
+
+        self._state = state
+        self.transitions[state] += 1
+        self._calls.clear()
+        self._half_open_started = 0
+        self._half_open_succeeded = 0
+
+        if state is CircuitState.OPEN:
+            self._opened_at = time.monotonic()
+
+
+class SteamFailures:
+    """Ошибки запросов к Steam API клиента, сгруппированные по методу API и классу ошибки
+
+    Клиент не пишет в лог каждую ошибку, а копит их здесь, чтобы во время недоступности Steam
+    вызывающий код мог записать одну сводку на весь запрос
+    """
+
+    max_examples = 5
+
+    def __init__(self) -> None:
+        self.counts: Counter[tuple[str, str]] = Counter()
+        # Первое исключение и первые max_examples steam_id для каждой группы
+        self.samples: dict[tuple[str, str], BaseException] = {}
+        self.examples: dict[tuple[str, str], list[str]] = {}
+
+    def __bool__(self) -> bool:
+        return bool(self.counts)
+
+    def add(self, *, endpoint: str, error: BaseException | str, steam_ids: Sequence[str] = ()) -> None:
+        """
+        Args:
+            endpoint: Метод Steam API
+            error: Исключение или описание ошибки без исключения, например неверный статус ответа
+        """
+        key = (endpoint, error if isinstance(error, str) else type(error).__name__)
+        self.counts[key] += 1
+
+        if isinstance(error, BaseException):
+            self.samples.setdefault(key, error)
+
+        examples = self.examples.setdefault(key, [])
+        examples.extend(steam_ids[: self.max_examples - len(examples)])
+
+    def clear(self) -> None:
+        self.counts.clear()
+        self.samples.clear()
+        self.examples.clear()
+
+
+class SteamApiKey:
+    """Ключ Steam API со своим лимитом запросов и состоянием"""
+
+    def __init__(self, *, value: str, index: int, requests_per_second: float, daily_limit: int) -> None:
+        self.value = value
+        # Номер в пуле делает имя уникальным, даже если у ключей совпадают последние символы
+        self.name = f"#{index} ...{value[-4:]}"
+        self.requests_per_second = requests_per_second
+        self.daily_limit = daily_limit
+
+        self.tokens = float(requests_per_second)
+        self.tokens_updated_at = time.monotonic()
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.day: date = datetime.now(timezone.utc).date()
+        self.day_requests = 0
+
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+
+    def refresh(self, now: float) -> None:
+        today = datetime.now(timezone.utc).date()
+        if today != self.day:
+            self.day = today
+            self.day_requests = 0
+
+        if self.requests_per_second:
+            self.tokens = min(
+                float(self.requests_per_second),
+                self.tokens + (now - self.tokens_updated_at) * self.requests_per_second,
+            )
+        self.tokens_updated_at = now
+
+    def is_healthy(self, now: float) -> bool:
+        return now >= self.cooldown_until and self.day_requests < self.daily_limit
+
+    def has_tokens(self) -> bool:
+        return not self.requests_per_second or self.tokens >= 1
+
+    def seconds_to_token(self) -> float:
+        if self.has_tokens():
+            return 0
+        return (1 - self.tokens) / self.requests_per_second
+
+
+class SteamKeyPool:
+    """Пул ключей Steam API, общий для всех экземпляров SteamConnectAsync в
+    процессе
+
+    Каждый запрос уходит с наименее загруженного здорового ключа, у которого
+    остался лимит. Ключ получивший 403 или 429 отправляется отдыхать на
+    cooldown секунд. requests_per_second = 0 - без ограничения в секунду
+    """
+
+    def __init__(
+        self, *, keys: Sequence[str], requests_per_second: float = 0, daily_limit: int = 100_000, cooldown: float = 60
+    ) -> None:
+        if not keys:
+            raise ValueError("Steam API key pool requires at least one key")
+
+        self.cooldown = cooldown
+        self.keys = [
+            SteamApiKey(value=key, index=index, requests_per_second=requests_per_second, daily_limit=daily_limit)
+            for index, key in enumerate(keys)
+        ]
+        self._lock = threading.Lock()
+
+    async def acquire(self, *, timeout: float) -> SteamApiKey:
+        """Выбирает ключ для запроса, если у всех здоровых ключей закончился
+        лимит в секунду - ждет, но не дольше timeout
+
+        Raises:
+            SteamKeysExhaustedError: Если здоровых ключей нет или лимит не освободился за timeout
+        """
+        deadline = time.monotonic() + timeout
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                healthy_keys = []
+                for key in self.keys:
+                    key.refresh(now)
+                    if key.is_healthy(now):
+                        healthy_keys.append(key)
+
+                if not healthy_keys:
+                    for key in self.keys:
+                        key.rejected += 1
+                    raise SteamKeysExhaustedError("All Steam API keys are cooling down or out of daily limit")
+
+                ready_keys = [key for key in healthy_keys if key.has_tokens()]
+                if ready_keys:
+                    key = min(ready_keys, key=lambda key: (key.in_flight, -key.tokens))
+                    if key.requests_per_second:
+                        key.tokens -= 1
+                    key.in_flight += 1
+                    key.day_requests += 1
+                    key.requests += 1
+                    return key
+
+                wait = min(key.seconds_to_token() for key in healthy_keys)
+
+            if now + wait > deadline:
+                raise SteamKeysExhaustedError("Steam API keys rate limit is exceeded")
+
+            await asyncio.sleep(wait)
+
+    def release(self, key: SteamApiKey, *, status: int | None) -> None:
+        """
+        Args:
+            status: Статус ответа Steam, None если ответа не было
+        """
+        with self._lock:
+            key.in_flight -= 1
+
+            if status == 200:
+                return
+
+            key.errors += 1
+            if status in (403, 429):
+                key.cooldown_until = time.monotonic() + self.cooldown
+                logging.warning(f"Ключ Steam API {key.name} получил статус {status}, отдыхает {self.cooldown} с")
+
+    def cancel(self, key: SteamApiKey) -> None:
+        """Возвращает ключ, полученный через acquire, если запрос с ним так и не был отправлен"""
+        with self._lock:
+            key.in_flight -= 1
+            key.day_requests -= 1
+            key.requests -= 1
+            if key.requests_per_second:
+                key.tokens += 1
+
+    def usage(self) -> dict[str, dict[str, int | bool]]:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                key.name: {
+                    "healthy": key.is_healthy(now),
+                    "in_flight": key.in_flight,
+                    "day_requests": key.day_requests,
+                    "requests": key.requests,
+                    "errors": key.errors,
+                    "rejected": key.rejected,
+                }
+                for key in self.keys
+            }
+
+
 class SteamConnectAsync:
-    def __init__(self, *, api_key: str, timeout: float, max_chunk_size: int = 100) -> None:
-        self.api_key: str = api_key
+    def __init__(
+        self,
+        *,
+        timeout: float,
+        api_key: str | None = None,
+        key_pool: SteamKeyPool | None = None,
+        max_chunk_size: int = 100,
+        circuit_breaker: CircuitBreaker | None = None,
+    ) -> None:
+        if key_pool is None:
+            if api_key is None:
+                raise ValueError("api_key or key_pool is required")
+            key_pool = SteamKeyPool(keys=[api_key])
+
+        self.key_pool: SteamKeyPool = key_pool
         self.timeout: float = timeout
         self.max_chunk_size: int = max_chunk_size
+        self.circuit_breaker: CircuitBreaker | None = circuit_breaker
+        self.failures: SteamFailures = SteamFailures()
 
         client_timeout = aiohttp.ClientTimeout(self.timeout)
         self._session: aiohttp.ClientSession = aiohttp.ClientSession(_STEAM_PLAYER_API_BASE_URL, timeout=client_timeout)
@@ -43,53 +395,47 @@ class SteamConnectAsync:
         return None
 
     async def get_recently_played_games(self, *, steam_id):
-        params = {"steamid": steam_id, "key": self.api_key}
+        params = {"steamid": steam_id}
+
+        endpoint = "GetRecentlyPlayedGames"
 
         try:
-            async with self._session.get("IPlayerService/GetRecentlyPlayedGames/v1/", params=params) as response:
+            async with self._request("IPlayerService/GetRecentlyPlayedGames/v1/", params=params) as response:
                 if response.status != 200:
-                    logging.warning(
-                        f"Неверный статус код при получении списка игр у пользователя {steam_id},"
-                        f" статус код {response.status}"
-                    )
+                    self.failures.add(endpoint=endpoint, error=f"HTTP {response.status}", steam_ids=[steam_id])
                     return None
 
                 data = await response.json()
 
                 return data["response"]["games"]
-        except aiohttp.ClientError as e:
-            logging.error(f"Ошибка при получении списка последних сыгранных игр у пользователя {steam_id}, ошибка: {e}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.failures.add(endpoint=endpoint, error=e, steam_ids=[steam_id])
             return None
         except KeyError as e:
-            logging.error(f"У пользователя {steam_id} не найдены игры. KeyError {e}")
-            return None
-        except asyncio.TimeoutError as e:
-            logging.error(f"Таймаут при запросе последних игр у пользователя {steam_id}, TimeoutError {e}")
+            # У пользователя не найдены игры
+            self.failures.add(endpoint=endpoint, error=e, steam_ids=[steam_id])
             return None
 
     async def get_owned_games(self, *, steam_id):
-        params = {"steamid": steam_id, "include_appinfo": "true", "key": self.api_key}
+        params = {"steamid": steam_id, "include_appinfo": "true"}
+
+        endpoint = "GetOwnedGames"
 
         try:
-            async with self._session.get("IPlayerService/GetOwnedGames/v1/", params=params) as response:
+            async with self._request("IPlayerService/GetOwnedGames/v1/", params=params) as response:
                 if response.status != 200:
-                    logging.warning(
-                        f"Неверный статус код при получении списка игр у пользователя {steam_id},"
-                        f" статус код {response.status}"
-                    )
+                    self.failures.add(endpoint=endpoint, error=f"HTTP {response.status}", steam_ids=[steam_id])
                     return None
 
                 data = await response.json()
 
                 return data["response"]["games"]
-        except aiohttp.ClientError as e:
-            logging.error(f"Ошибка при получении списка игр у пользователя {steam_id}, ошибка: {e}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.failures.add(endpoint=endpoint, error=e, steam_ids=[steam_id])
             return None
         except KeyError as e:
-            logging.error(f"У пользователя {steam_id} не найдены игры. KeyError {e}")
-            return None
-        except asyncio.TimeoutError as e:
-            logging.error(f"Таймаут при запросе списка игр у пользователя {steam_id}, TimeoutError {e}")
+            # У пользователя не найдены игры
+            self.failures.add(endpoint=endpoint, error=e, steam_ids=[steam_id])
             return None
 
     async def get_player_data(self, *, steam_id: str) -> dict[str, str | int | float] | None:
@@ -100,7 +446,7 @@ class SteamConnectAsync:
             else:
                 return None
         except IndexError as e:
-            logging.error(f"Ошибка при получении информации о пользователе {steam_id}, ошибка: {e}")
+            self.failures.add(endpoint="GetPlayerSummaries", error=e, steam_ids=[steam_id])
             return None
 
     async def get_players_data(self, *, steam_ids: Sequence[str]) -> list[dict[str, str | int | float]] | None:
@@ -108,30 +454,91 @@ class SteamConnectAsync:
             steam_ids[i : i + self.max_chunk_size] for i in range(0, len(steam_ids), self.max_chunk_size)
         ]
 
+        endpoint = "GetPlayerSummaries"
+
         ret_data = []
         for ids_chunk in steam_ids_chunks:
-            params = {"steamids": ",".join(ids_chunk), "key": self.api_key}
+            params = {"steamids": ",".join(ids_chunk)}
 
             try:
-                async with self._session.get("ISteamUser/GetPlayerSummaries/v1/", params=params) as response:
+                async with self._request("ISteamUser/GetPlayerSummaries/v1/", params=params) as response:
                     if response.status != 200:
-                        logging.warning(
-                            f"Неверный статус код при получении информации о пользователях {ids_chunk}:"
-                            f" {response.status}"
-                        )
+                        self.failures.add(endpoint=endpoint, error=f"HTTP {response.status}", steam_ids=ids_chunk)
                         return None
 
                     ret_data.extend((await response.json())["response"]["players"]["player"])
 
-            except (aiohttp.ClientError, KeyError, IndexError) as e:
-                logging.error(f"Ошибка при получении информации о пользователях {steam_ids}, ошибка: {type(e)} {e}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.failures.add(endpoint=endpoint, error=e, steam_ids=ids_chunk)
                 return None
-            except asyncio.TimeoutError as e:
-                logging.error(f"Таймаут при запросе информации о пользователях {steam_ids}, TimeoutError {e}")
+            except (KeyError, IndexError) as e:
+                self.failures.add(endpoint=endpoint, error=e, steam_ids=ids_chunk)
                 return None
 
         return ret_data
 
+    @asynccontextmanager
+    async def _request(self, path: str, *, params: dict[str, str]) -> AsyncIterator[aiohttp.ClientResponse]:
+        """GET запрос к Steam API через circuit breaker и ключ из пула
+
+        Ошибки соединения и таймауты до получения статуса записываются в circuit breaker
+        как неудачные запросы, остальные прерывания (отмена и т.д.) возвращают пробное место
+
+        Raises:
+            SteamUnavailableError: Если circuit breaker разомкнут или нет доступных ключей
+        """
+        # Если ключ упёрся в лимит - повторяем запрос с другим ключом
+        attempts = len(self.key_pool.keys)
+        for attempt in range(1, attempts + 1):
+            if self.circuit_breaker is not None and self.circuit_breaker.is_rejecting():
+                raise SteamUnavailableError("Steam API circuit breaker is open")
+
+            # Ключ берется до пробного места circuit breaker, чтобы нехватка ключей его не занимала
+            key = await self.key_pool.acquire(timeout=self.timeout)
+
+            if self.circuit_breaker is not None and not self.circuit_breaker.allow_request():
+                self.key_pool.cancel(key)
+                raise SteamUnavailableError("Steam API circuit breaker is open")
+
+            status = None
+            try:
+                async with self._session.get(path, params=params | {"key": key.value}) as response:
+                    status = response.status
+                    self._record_status(status)
+
+                    if status in (403, 429) and attempt < attempts:
+                        continue
+
+                    yield response
+                    return
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if status is None:
+                    self._record_failure()
+                raise
+            except BaseException:
+                if status is None:
+                    self._release_circuit_request()
+                raise
+            finally:
+                self.key_pool.release(key, status=status)
+
+    def _record_status(self, status: int) -> None:
+        if self.circuit_breaker is None:
+            return
+
+        if status == 429 or status >= 500:
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()
+
+    def _record_failure(self) -> None:
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_failure()
+
+    def _release_circuit_request(self) -> None:
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.release_request()
+
     def _search_game_in_list(self, *, game_list, game_id) -> None | int:
         for game in game_list:
             if game["appid"] == game_id: